@@ -0,0 +1,10 @@
+"""
+Ubagofish Scheduler — benchmarks
+Synthetic trade-fair events (`synthetic.make_event`) and a timing runner (`run`) that
+measures each scheduler phase separately, writes the results as JSON and compares them
+against a stored baseline:
+
+    python -m benchmarks.run                      # all scenarios, compare with baseline.json
+    python -m benchmarks.run -s small -s medium   # a subset
+    python -m benchmarks.run --save-baseline      # record this machine's numbers as the baseline
+"""
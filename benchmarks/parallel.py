@@ -0,0 +1,82 @@
+"""
+Randomizer process pool: determinism check and sequential-vs-pool timing.
+
+The pool must never change the result, so every case runs with workers=1 and workers=N and
+the appointment lists are compared; any difference makes the run exit with status 1. The
+timings show from which size the pool pays for its start-up and pickling on this machine;
+set `ubagofish_engine.PARALLEL_MIN_PAIRS` from them on the machine that serves the app.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import ubagofish_engine
+from ubagofish_engine import DAYS
+
+from benchmarks.synthetic import SCENARIOS, make_event
+
+# (buyers, clients, days) timed on top of the regular scenarios
+LARGE_SIZES = [(2000, 4000, 6), (3000, 8000, 6)]
+
+
+def run(buyers: int, clients: int, days: int, workers: int, seed: int = 0, **params) -> tuple:
+    """(appointments, seconds) of one randomize() on a fresh synthetic event."""
+    sched = make_event(buyers, clients, days, seed=seed)
+    start = time.perf_counter()
+    sched.randomize(sched.buyers, sched.clients, workers=workers, **params)
+    return list(sched.appointments), time.perf_counter() - start
+
+
+def check_determinism(cases: int, workers: int) -> list[str]:
+    """Randomized small events, forced onto the pool; lines describing every mismatch."""
+    rnd = random.Random(1)
+    failures = []
+    saved = ubagofish_engine.PARALLEL_MIN_PAIRS
+    ubagofish_engine.PARALLEL_MIN_PAIRS = 0  # small events would otherwise never use the pool
+    try:
+        for case in range(cases):
+            size = (rnd.randint(1, 40), rnd.randint(1, 120), rnd.randint(2, len(DAYS)))
+            params = {"interval": rnd.choice([30, 60]), "appts_before_rest": rnd.randint(1, 4),
+                      "rest_slots": rnd.randint(1, 3)}
+            seq, _ = run(*size, workers=1, seed=case, **params)
+            par, _ = run(*size, workers=workers, seed=case, **params)
+            if seq != par:
+                failures.append(f"case {case} {size} {params}: workers=1 and workers={workers} differ")
+    finally:
+        ubagofish_engine.PARALLEL_MIN_PAIRS = saved
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=max(os.cpu_count() or 1, 2))
+    parser.add_argument("--cases", type=int, default=300, help="randomized determinism cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-timing", action="store_true", help="only run the determinism check")
+    args = parser.parse_args(argv)
+
+    failures = check_determinism(args.cases, args.workers)
+    print(f"determinism: {args.cases - len(failures)}/{args.cases} cases identical with workers={args.workers}")
+    if not args.no_timing:
+        print(f"{os.cpu_count()} CPUs; PARALLEL_MIN_PAIRS = {ubagofish_engine.PARALLEL_MIN_PAIRS:,}")
+        saved = ubagofish_engine.PARALLEL_MIN_PAIRS
+        ubagofish_engine.PARALLEL_MIN_PAIRS = 0
+        try:
+            for size in list(SCENARIOS.values()) + LARGE_SIZES:
+                seq = min(run(*size, workers=1)[1] for _ in range(args.repeat))
+                par = min(run(*size, workers=args.workers)[1] for _ in range(args.repeat))
+                pairs = size[0] * size[1]
+                print(f"{size[0]}x{size[1]}x{size[2]} ({pairs:,} pairs)  sequential={seq * 1000:.1f}ms  "
+                      f"workers={args.workers}={par * 1000:.1f}ms  {'pool wins' if par < seq else 'sequential wins'}")
+        finally:
+            ubagofish_engine.PARALLEL_MIN_PAIRS = saved
+    for line in failures:
+        print("MISMATCH", line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
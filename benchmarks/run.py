@@ -0,0 +1,174 @@
+"""
+Time each scheduler phase on the synthetic scenarios and compare with a baseline.
+
+Every phase is run `--repeat` times on a freshly generated event; the best time is compared
+and the spread (median minus best) is kept as the phase's measured noise. A phase regresses
+when its best time is more than `--threshold` slower than the baseline and the gap is above
+both NOISE_FLOOR seconds and NOISE_SPREADS times the larger of the two spreads. A scenario
+with a regression is measured again (`--retries` times, keeping the best of all runs), so a
+slowdown has to hold across runs; any regression left makes the run exit with status 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from ubagofish_audit import audit_schedule
+from ubagofish_engine import HOURS, calendar_frame, load_schedule, save_schedule
+from ubagofish_export import export_excel
+from ubagofish_solver import repair_schedule, solve_matching
+
+from benchmarks.synthetic import SCENARIOS, make_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+RESULTS = os.path.join(HERE, "results.json")
+NOISE_FLOOR = 0.05  # seconds; smaller gaps are timer and scheduler noise, never a regression
+NOISE_SPREADS = 3  # gaps within this many spreads of the phase are noise too
+CONFLICT_QUERIES = 20_000
+LATE_CLIENTS = 5  # clients added after the schedule was generated, for the repair phase
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_scenario(name: str, repeat: int, samples: dict = None) -> dict:
+    """Best time and spread per phase for one scenario, plus the sizes it ran on.
+
+    `samples` ({phase: [seconds, ...]}) holds the times of earlier runs to pool with this one.
+    """
+    buyers, clients, days = SCENARIOS[name]
+    times = {} if samples is None else samples
+
+    def best(phase, seconds):
+        times.setdefault(phase, []).append(seconds)
+
+    for _ in range(repeat):
+        sched = make_event(buyers, clients, days)
+        best("randomize", _timed(lambda: sched.randomize(sched.buyers, sched.clients)))
+
+        matched = make_event(buyers, clients, days)
+        best("matching", _timed(lambda: solve_matching(matched, matched.buyers, matched.clients)))
+
+        late = make_event(buyers, clients, days)
+        late.randomize(late.buyers, late.clients)
+        late_clients = [f"Late {i}" for i in range(LATE_CLIENTS)]
+        late.clients = late.clients + late_clients
+        best("repair", _timed(lambda: repair_schedule(late, late.buyers, late_clients)))
+
+        rnd = random.Random(1)
+        slots = list(sched.day_slots())
+        queries = [(rnd.choice(sched.clients), rnd.choice(sched.buyers), rnd.choice(sched.selected_days), HOURS[rnd.choice(slots)])
+                   for _ in range(CONFLICT_QUERIES)]
+
+        def conflicts():
+            for c, b, d, t in queries:
+                sched.is_slot_free(c, b, d, t)
+                sched.common_free_mask(c, b, d)
+
+        best("conflicts", _timed(conflicts))
+        best("audit", _timed(lambda: audit_schedule(sched)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "event.json")
+            best("json_save", _timed(lambda: save_schedule(sched, path)))
+            best("json_load", _timed(lambda: load_schedule(path)))
+            path = os.path.join(tmp, "event.ubs")
+            best("snapshot_save", _timed(lambda: save_schedule(sched, path)))
+            best("snapshot_load", _timed(lambda: load_schedule(path)))
+
+        calendar_frame(sched)  # grids are kept up to date across reruns; time the frame itself
+        sched._calendar_cache.clear()
+        best("calendar", _timed(lambda: calendar_frame(sched)))
+        best("export", _timed(lambda: export_excel(sched)))
+
+    return {"buyers": buyers, "clients": clients, "days": days,
+            "appointments": len(sched.appointments), "runs": len(times["export"]),
+            "seconds": {phase: min(ts) for phase, ts in times.items()},
+            "spread": {phase: statistics.median(ts) - min(ts) for phase, ts in times.items()},
+            "samples": times}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Lines describing every phase that regressed beyond the threshold or has no baseline to compare with."""
+    failures = []
+    for name, res in results["scenarios"].items():
+        base_res = baseline.get("scenarios", {}).get(name, {})
+        base, base_spread = base_res.get("seconds", {}), base_res.get("spread", {})
+        for phase, seconds in res["seconds"].items():
+            ref = base.get(phase)
+            if ref is None:  # an unchecked phase is a gap in the thresholds, not a pass
+                failures.append(f"{name}/{phase}: {seconds:.4f}s, not in the baseline (re-record it with --save-baseline)")
+                continue
+            noise = NOISE_SPREADS * max(res.get("spread", {}).get(phase, 0), base_spread.get(phase, 0))
+            if seconds - ref > max(ref * threshold, NOISE_FLOOR, noise):
+                failures.append(f"{name}/{phase}: {seconds:.4f}s vs baseline {ref:.4f}s (+{seconds / ref - 1:.0%}, "
+                                f"noise {noise:.4f}s)")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--retries", type=int, default=1, help="re-measurements of a scenario that regressed")
+    parser.add_argument("--output", default=RESULTS)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": {},
+    }
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = []
+    for name in args.scenario or list(SCENARIOS):
+        res = bench_scenario(name, args.repeat)
+        for _ in range(args.retries if baseline is not None else 0):
+            if not compare({"scenarios": {name: res}}, baseline, args.threshold):
+                break
+            print(f"{name:7} slower than the baseline, measuring again")
+            res = bench_scenario(name, args.repeat, res["samples"])
+        del res["samples"]
+        results["scenarios"][name] = res
+        phases = "  ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in res["seconds"].items())
+        print(f"{name:7} {res['buyers']}x{res['clients']}x{res['days']} ({res['appointments']} appts)  {phases}")
+        if baseline is not None:
+            failures += compare({"scenarios": {name: res}}, baseline, args.threshold)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    for line in failures:
+        print("REGRESSION", line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
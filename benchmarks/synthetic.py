@@ -0,0 +1,47 @@
+"""Synthetic events for the benchmarks: seeded, so every run times the same schedule."""
+
+import random
+
+from ubagofish_engine import DAYS, HOURS, Schedule
+
+# name -> (buyers, clients, days); sizes follow our trade fairs (50-1,000 buyers)
+SCENARIOS = {
+    "small": (50, 200, 2),
+    "medium": (200, 800, 3),
+    "large": (500, 2000, 6),
+    "xlarge": (1000, 3000, 6),
+}
+
+
+def make_event(buyers: int, clients: int, days: int, locked_density: float = 0.05,
+               window_share: float = 0.3, seed: int = 0) -> Schedule:
+    """Event with `buyers` x `clients` over the first `days` DAYS.
+
+    - `locked_density`: share of each buyer's working slots pre-booked with a locked
+      appointment (random client that is free at that slot).
+    - `window_share`: share of buyers with a narrower per-day time window.
+    """
+    rnd = random.Random(seed)
+    buyer_names = [f"Buyer {i:04d}" for i in range(buyers)]
+    client_names = [f"Client {i:04d}" for i in range(clients)]
+    sched = Schedule(clients=client_names, buyers=buyer_names, selected_days=DAYS[:days])
+
+    day_slots = [s for s in sched.day_slots() if not sched.lunch_mask[s]]
+    for b in buyer_names:
+        if rnd.random() < window_share:
+            for d in sched.selected_days:
+                start = rnd.choice(day_slots[:len(day_slots) // 2])
+                end = rnd.choice(day_slots[len(day_slots) // 2:])
+                sched.set_time_window(b, d, HOURS[start], HOURS[end])
+
+    for b in buyer_names:
+        for d in sched.selected_days:
+            for slot in day_slots:
+                if rnd.random() >= locked_density:
+                    continue
+                for _ in range(5):  # a few tries to find a client free at that slot
+                    c = rnd.choice(client_names)
+                    if sched.slot_free(c, b, d, slot):
+                        sched.add_appointment({"client": c, "buyer": b, "day": d, "time": HOURS[slot], "locked": True})
+                        break
+    return sched
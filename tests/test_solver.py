@@ -0,0 +1,17 @@
+from ubagofish_engine import Schedule
+from ubagofish_solver import repair_schedule
+
+
+def appt(buyer, client, time, day="Monday"):
+    return {"buyer": buyer, "client": client, "day": day, "time": time, "locked": False}
+
+
+def test_repair_does_not_rebook_a_pair_in_a_double_booked_cell():
+    sched = Schedule(buyers=["B1", "B2"], clients=["C1", "C2", "C3"], selected_days=["Monday"],
+                     appointments=[appt("B1", "C1", "09:00"), appt("B1", "C2", "09:00"),
+                                   appt("B2", "C3", "09:00"), appt("B2", "C3", "09:00")])
+    result = repair_schedule(sched, ["B1", "B2"], ["C1", "C2", "C3"])
+    assert (result["placed"], result["unplaced"]) == (3, [])
+    pairs = sorted((a["buyer"], a["client"]) for a in sched.appointments)
+    assert pairs == [("B1", "C1"), ("B1", "C2"), ("B1", "C3"),
+                     ("B2", "C1"), ("B2", "C2"), ("B2", "C3"), ("B2", "C3")]
@@ -0,0 +1,77 @@
+import pytest
+
+from ubagofish_engine import Schedule
+from ubagofish_service import apply_changes
+from ubagofish_storage import JsonStore, SnapshotStore, file_lock
+
+STORES = [(JsonStore, ".json"), (SnapshotStore, ".ubs")]
+
+
+def appt(buyer, client, time, day="Monday"):
+    return {"buyer": buyer, "client": client, "day": day, "time": time, "locked": False}
+
+
+def on_disk(cls, path):
+    sched = Schedule()
+    cls(path).load(sched)
+    return sched
+
+
+def two_writers(cls, path, **event):
+    """(sched, store) pairs for two processes that both loaded the same event file."""
+    cls(path).save(Schedule(**event))
+    pairs = [(Schedule(), cls(path)), (Schedule(), cls(path))]
+    for sched, store in pairs:
+        store.load(sched)
+    return pairs
+
+
+@pytest.mark.parametrize("cls,ext", STORES)
+def test_save_after_a_foreign_save_keeps_its_changes(tmp_path, cls, ext):
+    path = str(tmp_path / ("event" + ext))
+    (app, app_store), (svc, svc_store) = two_writers(cls, path, buyers=["B1", "B2", "B3"], clients=["C1", "C2", "C3"])
+    app.add_appointment(appt("B1", "C1", "09:00"))
+    app_store.save(app)
+    # the service saves twice without reloading: the app's booking must survive both merges
+    svc.add_appointment(appt("B2", "C2", "09:00"))
+    svc_store.save(svc)
+    svc.add_appointment(appt("B3", "C3", "09:00"))
+    svc_store.save(svc)
+    assert sorted(a["buyer"] for a in on_disk(cls, path).appointments) == ["B1", "B2", "B3"]
+    # a deletion after the merge is still a deletion
+    svc.remove_appointment(svc.find_appointments(buyer="B3")[0])
+    svc_store.save(svc)
+    assert sorted(a["buyer"] for a in on_disk(cls, path).appointments) == ["B1", "B2"]
+    assert svc_store.load(svc) and len(svc.appointments) == 2
+
+
+@pytest.mark.parametrize("cls,ext", STORES)
+def test_meeting_booked_on_both_sides_is_saved_once(tmp_path, cls, ext):
+    path = str(tmp_path / ("event" + ext))
+    (app, app_store), (svc, svc_store) = two_writers(cls, path, buyers=["B1", "B2"], clients=["C1", "C2"])
+    app_store.delay = 60
+    app.add_appointment(appt("B2", "C2", "11:00"))
+    app_store.autosave(app)  # pending: the app's load() is skipped until it is written
+    x = appt("B1", "C1", "10:00")
+    svc.add_appointment(x)
+    svc_store.save(svc)
+    assert not app_store.load(app)
+    apply_changes(app, [{"seq": 1, "op": "book", "appointment": x}])  # the change feed
+    app_store.delay = 0  # cancels the timer and writes now
+    app_store.autosave(app)
+    assert sorted(a["time"] for a in on_disk(cls, path).appointments) == ["10:00", "11:00"]
+
+
+@pytest.mark.parametrize("cls,ext", STORES)
+def test_store_that_could_not_load_does_not_overwrite_the_event(tmp_path, cls, ext):
+    path = str(tmp_path / ("event" + ext))
+    cls(path).save(Schedule(buyers=["B1"], clients=["C1"], selected_days=["Friday"],
+                            appointments=[appt("B1", "C1", "09:00", day="Friday")]))
+    sched, store = Schedule(), cls(path, delay=0, lock_timeout=0.05)
+    with file_lock(path), pytest.raises(TimeoutError):
+        store.load(sched)
+    sched.add_appointment(appt("B2", "C2", "10:00"))
+    store.autosave(sched)
+    saved = on_disk(cls, path)
+    assert (saved.buyers, saved.clients, saved.selected_days) == (["B1"], ["C1"], ["Friday"])
+    assert len(saved.appointments) == 2
@@ -0,0 +1,113 @@
+"""
+Ubagofish Scheduler — appointment audit
+One pass over the appointment columns that reports every rule the schedule breaks, whatever
+path the appointments came in by (JSON upload, legacy file, bulk import, another process):
+double bookings of a buyer or a client, repeated appointments, and appointments at lunch,
+outside the day, on a day that is not scheduled or outside the buyer's time window.
+
+Notes:
+- Collisions and repeats are found by sorting composite (day, participant, slot) keys, so the
+  audit is O(n log n) in the number of appointments; the per-appointment checks are vectorized
+  lookups. Only flagged groups are visited one by one.
+- Identical appointments count as a `duplicate` (every copy after the first); the copies are
+  left out of the collision checks, so a buyer booked twice with the same client is reported
+  once, not three times.
+- The report is plain data (counts plus one issue per flagged appointment and rule) so it can
+  feed a dashboard or be exported; `issues_frame()` turns it into a DataFrame.
+"""
+
+import numpy as np
+
+from ubagofish_engine import HOURS, Schedule, idx_of
+
+# issue kinds, in report order
+ISSUES = ("buyer_double_booking", "client_double_booking", "duplicate", "lunch", "outside_day",
+          "unscheduled_day", "outside_window")
+
+
+def _groups(key: np.ndarray) -> tuple:
+    """(order, starts, sizes) of the runs of equal keys; rows keep table order inside a run."""
+    order = np.argsort(key, kind="stable")
+    k = key[order]
+    starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]]) if len(k) else np.zeros(0, np.int64)
+    return order, starts, np.diff(np.r_[starts, len(k)])
+
+
+def audit_schedule(sched: Schedule) -> dict:
+    """Every broken rule in `sched`.
+
+    Returns {"appointments": n, "counts": {kind: issues}, "issues": [issue, ...]} where each issue
+    is {"kind", "id", "client", "buyer", "day", "time", "locked", "others"}: the appointment ID and
+    fields, plus the IDs of the appointments it collides with (double bookings and duplicates).
+    """
+    table = sched.appointments
+    issues = {kind: [] for kind in ISSUES}
+    n = len(table)
+    if n:
+        ids = table.column("ids")
+        b, c = table.column("buyer").astype(np.int64), table.column("client").astype(np.int64)
+        d, s = table.column("day").astype(np.int64), table.column("slot").astype(np.int64)
+        buyer_names, client_names, day_names = table.names
+        nb, nc, n_slots = max(len(buyer_names), 1), max(len(client_names), 1), len(HOURS)
+
+        def flag(kind, rows, others=None):
+            for k, i in enumerate(rows.tolist()):
+                issues[kind].append((i, others[k] if others is not None else []))
+
+        def collisions(kind, rows, key):
+            order, starts, sizes = _groups(key)
+            for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+                group_rows = rows[order[start:start + size]]
+                group = ids[group_rows].tolist()
+                flag(kind, group_rows, [group[:k] + group[k + 1:] for k in range(size)])
+
+        # identical appointments: every copy after the first
+        order, starts, sizes = _groups(((d * nb + b) * nc + c) * n_slots + s)
+        is_copy = np.ones(n, bool)
+        is_copy[order[starts]] = False
+        copy_sorted = is_copy[order]
+        first = np.repeat(ids[order[starts]], sizes)[copy_sorted]
+        flag("duplicate", order[copy_sorted], [[aid] for aid in first.tolist()])
+        rows = np.flatnonzero(~is_copy)
+        collisions("buyer_double_booking", rows, (d[rows] * nb + b[rows]) * n_slots + s[rows])
+        collisions("client_double_booking", rows, (d[rows] * nc + c[rows]) * n_slots + s[rows])
+
+        flag("lunch", np.flatnonzero(np.array(sched.lunch_mask, bool)[s]))
+        day_slots = sched.day_slots()
+        flag("outside_day", np.flatnonzero((s < day_slots.start) | (s >= day_slots.stop)))
+        scheduled = np.array([day in sched.selected_days for day in day_names] or [False], bool)
+        flag("unscheduled_day", np.flatnonzero(~scheduled[d]))
+
+        # explicit buyer windows as [buyer code, day code] bounds; unset ones allow the whole day
+        lo = np.zeros((nb, max(len(day_names), 1)), np.int64)
+        hi = np.full_like(lo, n_slots)
+        buyer_code = {name: i for i, name in enumerate(buyer_names)}
+        day_code = {name: i for i, name in enumerate(day_names)}
+        for buyer, days in sched.time_windows.items():
+            for day, window in days.items():
+                if buyer in buyer_code and day in day_code:
+                    lo[buyer_code[buyer], day_code[day]] = idx_of(window.get("start", sched.start_hour))
+                    hi[buyer_code[buyer], day_code[day]] = idx_of(window.get("end", sched.end_hour))
+        flag("outside_window", np.flatnonzero((s < lo[b, d]) | (s >= hi[b, d])))
+
+    flagged = [(kind, i, others) for kind in ISSUES for i, others in issues[kind]]
+    out = []
+    if flagged:
+        kinds, rows, others = zip(*flagged)
+        rows = np.array(rows, np.int64)
+        names = [np.array(col, dtype=object) for col in (client_names, buyer_names, day_names, HOURS)]
+        columns = (ids[rows].tolist(), names[0][c[rows]], names[1][b[rows]], names[2][d[rows]],
+                   names[3][s[rows]], table.column("locked")[rows].astype(bool).tolist())
+        out = [{"kind": kind, "id": aid, "client": client, "buyer": buyer, "day": day, "time": t,
+                "locked": locked, "others": o}
+               for kind, aid, client, buyer, day, t, locked, o in zip(kinds, *columns, others)]
+    return {"appointments": n, "counts": {kind: len(issues[kind]) for kind in ISSUES}, "issues": out}
+
+
+def issues_frame(report: dict):
+    """The report's issues as a DataFrame (one row per issue), for display or CSV export."""
+    import pandas as pd
+
+    df = pd.DataFrame(report["issues"], columns=["kind", "id", "client", "buyer", "day", "time", "locked", "others"])
+    df["others"] = df["others"].map(lambda ids: " ".join(f"#{aid}" for aid in ids))
+    return df
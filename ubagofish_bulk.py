@@ -0,0 +1,157 @@
+"""
+Ubagofish Scheduler — bulk booking import
+Pre-negotiated meetings from partner spreadsheets (CSV or XLSX): every row is validated against
+the event in one pass, the valid ones are added as locked appointments all at once, and the
+rest come back as a conflict report with the reason for each row.
+
+Notes:
+- Headers are matched case-insensitively: client/buyer/day/time, plus the app's Spanish
+  headers (Cliente/Comprador/Día/Hora). Days may be English or Spanish names; times may be
+  "9:00", "09:00:00", Excel times or day fractions.
+- The rules are the manual tab's: known buyer and client, a selected day, a time inside the day
+  and outside lunch, buyer and client free. Names, days, times and lunch are checked with
+  vectorized lookups, existing appointments through the occupancy grids, and repeats inside
+  the file with one hash-indexed pass in row order (earlier rows win, as if booked one by one).
+- Each rejected row gets the first rule it breaks. `row` is the spreadsheet row (header = 1).
+"""
+
+import datetime as dt
+from io import BytesIO
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from ubagofish_engine import DAY_OF, DAYS, SLOT_OF, Schedule
+
+COLUMNS = ("client", "buyer", "day", "time")
+HEADER_ALIASES = {
+    "client": "client", "cliente": "client",
+    "buyer": "buyer", "comprador": "buyer",
+    "day": "day", "día": "day", "dia": "day",
+    "time": "time", "hora": "time",
+}
+DAY_ALIASES = {
+    **{d.lower(): d for d in DAYS},
+    "lunes": "Monday", "martes": "Tuesday", "miércoles": "Wednesday", "miercoles": "Wednesday",
+    "jueves": "Thursday", "viernes": "Friday", "sábado": "Saturday", "sabado": "Saturday",
+}
+_TIME = re.compile(r"^(\d{1,2})[:.h](\d{2})(?::\d{2})?$")
+
+
+def read_bookings(data: bytes, filename: str) -> pd.DataFrame:
+    """Spreadsheet rows as a DataFrame with client/buyer/day/time columns (plus any others).
+
+    Raises ValueError for unsupported files or missing columns.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".csv":
+        # sep=None sniffs "," vs ";" (the default of Spanish Excel)
+        df = pd.read_csv(BytesIO(data), sep=None, engine="python", dtype=str, keep_default_na=False,
+                         encoding="utf-8-sig")
+    elif ext in (".xlsx", ".xlsm"):
+        df = pd.read_excel(BytesIO(data), dtype=object)
+    else:
+        raise ValueError(f"unsupported file type {ext or filename!r} (expected .csv or .xlsx)")
+    df = df.rename(columns={c: HEADER_ALIASES.get(str(c).strip().lower(), c) for c in df.columns})
+    missing = [c for c in COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+    return df
+
+
+def _time_label(value) -> str:
+    if isinstance(value, (dt.time, dt.datetime)):
+        return f"{value.hour:02d}:{value.minute:02d}"
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < 1:
+        minutes = round(value * 24 * 60)  # Excel stores times as fractions of a day
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+    m = _TIME.match(str(value).strip())
+    return f"{int(m.group(1)):02d}:{m.group(2)}" if m else ""
+
+
+def _text(series: pd.Series) -> pd.Series:
+    return series.fillna("").astype(str).str.strip()
+
+
+def _map_unique(series: pd.Series, fn) -> pd.Series:
+    """series.map(fn), calling fn once per distinct value."""
+    uniques = pd.unique(series)
+    return series.map(dict(zip(uniques, map(fn, uniques))))
+
+
+def check_bookings(sched: Schedule, df: pd.DataFrame) -> tuple:
+    """(appointments, report) for the rows of `df`.
+
+    `appointments` are the locked appointment dicts that can be booked together, in row order;
+    `report` has the rejected rows (original columns plus `row` and `reason`).
+    """
+    n = len(df)
+    client, buyer = _text(df["client"]), _text(df["buyer"])
+    day = _map_unique(_text(df["day"]), lambda d: DAY_ALIASES.get(d.lower(), d))
+    time = _map_unique(df["time"], _time_label)
+    reason = np.full(n, None, object)
+
+    def reject(mask, text):
+        mask = np.asarray(mask, bool) & (reason == None)  # noqa: E711 (elementwise)
+        reason[mask] = text
+
+    reject((client == "") | (buyer == "") | (day == "") | (time == ""), "missing field")
+    b_code = buyer.map(dict(zip(sched.buyers, sched.buyer_ids(sched.buyers))))
+    c_code = client.map(dict(zip(sched.clients, sched.client_ids(sched.clients))))
+    reject(b_code.isna(), "unknown buyer")
+    reject(c_code.isna(), "unknown client")
+    reject(~day.isin(sched.selected_days), "day not scheduled")
+    slot = time.map(SLOT_OF).fillna(-1).astype(int).to_numpy()
+    day_slots = sched.day_slots()
+    reject((slot < day_slots.start) | (slot >= day_slots.stop), "outside the day")
+    reject(np.asarray(sched.lunch_mask, bool)[slot], "lunch break")
+
+    ok = np.flatnonzero(reason == None)  # noqa: E711
+    d = day.iloc[ok].map(DAY_OF).to_numpy(np.int64)
+    s = slot[ok]
+    b = b_code.iloc[ok].to_numpy(np.int64)
+    c = c_code.iloc[ok].to_numpy(np.int64)
+    occ_b, _, occ_c, _ = sched.grids()
+    reject_ok = np.zeros(n, bool)
+    reject_ok[ok] = occ_b[d, s, b] >= 0
+    reject(reject_ok, "buyer already booked")
+    reject_ok[:] = False
+    reject_ok[ok] = occ_c[d, s, c] >= 0
+    reject(reject_ok, "client already booked")
+
+    # repeats inside the file: the first row wins, as if the rows were booked one by one
+    first_b, first_c = {}, {}
+    for i, key_b, key_c in zip(ok.tolist(), zip(d.tolist(), s.tolist(), b.tolist()),
+                               zip(d.tolist(), s.tolist(), c.tolist())):
+        if reason[i] is not None:
+            continue
+        if key_b in first_b:
+            reason[i] = f"buyer already booked in row {first_b[key_b] + 2}"
+        elif key_c in first_c:
+            reason[i] = f"client already booked in row {first_c[key_c] + 2}"
+        else:
+            first_b[key_b] = first_c[key_c] = i
+
+    good = np.flatnonzero(reason == None)  # noqa: E711
+    appointments = [
+        {"client": cl, "buyer": bu, "day": da, "time": ti, "locked": True}
+        for cl, bu, da, ti in zip(client.iloc[good], buyer.iloc[good], day.iloc[good], time.iloc[good])
+    ]
+    bad = reason != None  # noqa: E711
+    report = df[bad].copy()
+    report.insert(0, "row", np.flatnonzero(bad) + 2)
+    report["reason"] = reason[bad]
+    return appointments, report
+
+
+def import_bookings(sched: Schedule, df: pd.DataFrame) -> tuple:
+    """Book every valid row of `df` as locked in one step; returns (appointment IDs, report)."""
+    appointments, report = check_bookings(sched, df)
+    return sched.add_appointments(appointments), report
+
+
+def report_csv(report: pd.DataFrame) -> bytes:
+    """Conflict report as CSV that Excel opens with the right encoding."""
+    return report.to_csv(index=False).encode("utf-8-sig")
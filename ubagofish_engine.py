@@ -0,0 +1,862 @@
+"""
+Ubagofish Scheduler — scheduling engine
+Core shared by the Streamlit app, batch jobs and benchmarks. Importing this module never
+imports streamlit; pandas is only imported by the calendar builder (the Excel export lives in
+`ubagofish_export`).
+
+Notes:
+- `Schedule` holds names, settings and the appointments as an `AppointmentTable`: parallel
+  columns of interned buyer/client codes, day codes, slots and locked flags. Rows read back
+  as plain appointment dicts; `to_dict()` is the serialized form, tagged with `schema_version`
+  (older documents are migrated by `ubagofish_schema` on the way in).
+- Availability is kept as one integer bitmask per (day, buyer) and (day, client), bit i set
+  when slot i is busy; a common free slot is an AND plus a find-first-set. Double bookings
+  are counted separately, so removing one of them leaves the slot busy.
+- Calendar/export grids come from dense NumPy arrays [day, slot, buyer] -> client id and
+  [day, slot, client] -> buyer id, built on first use and then updated on every mutation.
+- Times are integer slot indexes into HOURS inside the engine; "09:30"-style strings only
+  appear in the appointment dicts and at the UI edges.
+- `Schedule.version` increases on every real change (appointments, names, settings), so
+  callers can tell cheaply whether anything needs saving or re-rendering;
+  `appointments_version` only counts appointment changes.
+- Every appointment gets an integer ID (the table's `ids` column, exposed as `by_id`) that
+  survives edits and other insertions/removals; IDs are session-only and never serialized.
+  `find_appointments` answers buyer/client/day/time filters with vectorized column scans.
+- Manual (locked) appointments are never removed by the randomizer.
+- The randomizer solves each selected day as an independent shard (optionally on a process
+  pool) and merges the shards in buyer order, so the result never depends on the worker count.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import itertools
+import os
+
+import numpy as np
+
+from ubagofish_schema import SCHEMA_VERSION, upgrade, upgrade_appointments
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+HOURS = [f"{h:02d}:{m:02d}" for h in range(6, 22) for m in (0, 30)]
+SLOT_OF = {t: i for i, t in enumerate(HOURS)}
+DAY_OF = {d: i for i, d in enumerate(DAYS)}
+
+SETTINGS = ("start_hour", "end_hour", "lunch_start", "lunch_end", "selected_days", "time_windows")
+# plain attributes the UI re-assigns on every rerun; only an actual change bumps the version
+_TRACKED = frozenset(("clients", "buyers") + SETTINGS)
+CALENDAR_CACHE_SIZE = 4  # calendar frames kept per schedule (LRU)
+# buyer x client pairs below which a process pool costs more to start than it saves; only
+# used when a caller asks for workers > 1. Calibrate with `python -m benchmarks.parallel` on the
+# serving machine: on one CPU the pool lost at every size up to 24M pairs (104 ms sequential).
+PARALLEL_MIN_PAIRS = 2_000_000
+DEFAULT_SETTINGS = {
+    "start_hour": "08:00",
+    "end_hour": "18:00",
+    "lunch_start": "12:00",
+    "lunch_end": "14:00",
+    "selected_days": ["Monday", "Tuesday"],
+}
+
+
+def idx_of(t: str) -> int:
+    return SLOT_OF[t]
+
+
+def normalize_appointments(appts_in) -> list[dict]:
+    """Normalize legacy tuple / Spanish-keyed appointments and the locked flag (any schema version)."""
+    return upgrade_appointments(appts_in, 0)
+
+
+def first_slot(mask: int) -> int:
+    """Lowest set bit of `mask` (find-first-set), -1 if empty."""
+    return (mask & -mask).bit_length() - 1
+
+
+def iter_slots(mask: int):
+    """Yield the set bits of `mask` in ascending order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def balanced_bucket(count: int, days: list[str]) -> dict:
+    """Return {day: n} appts distributed as evenly as possible."""
+    if not days:
+        return {}
+    q, r = divmod(count, len(days))
+    alloc = {d: q for d in days}
+    for i in range(r):
+        alloc[days[i % len(days)]] += 1
+    return alloc
+
+
+def split_by_day(clients: list[str], days: list[str]) -> dict:
+    """Return {day: [clients]}: consecutive blocks of `clients` sized by balanced_bucket."""
+    day_lists = {d: [] for d in days}
+    day_cycle = [d for d, n in balanced_bucket(len(clients), days).items() for _ in range(n)]
+    for d, client in zip(day_cycle, clients):
+        day_lists[d].append(client)
+    return day_lists
+
+
+def _fill_day(window: int, buyer_busy: dict, client_busy: dict, buyer: str, clients: list[str],
+              appts_before_rest: int, rest_slots: int) -> list[tuple[str, int]]:
+    """Place `clients` in the buyer's day; returns [(client, slot)] and marks the busy masks.
+
+    Each client takes the first slot at or after the cursor that is free for both sides
+    (one AND + find-first-set); the first client that no longer fits ends the day.
+    """
+    placed = []
+    cadence_count = 0
+    floor = 0  # slots below this bit are behind the cursor
+    for client in clients:
+        # Enforce cadence: after appts_before_rest, skip rest_slots slots of the buyer's window
+        if cadence_count >= appts_before_rest:
+            ahead = window >> floor << floor
+            for _ in range(rest_slots):
+                ahead &= ahead - 1
+            floor = first_slot(ahead) if ahead else len(HOURS)
+            cadence_count = 0
+
+        busy = buyer_busy.get(buyer, 0) | client_busy.get(client, 0)
+        free = (window & ~busy) >> floor << floor
+        if not free:
+            break
+        slot = first_slot(free)
+        buyer_busy[buyer] = buyer_busy.get(buyer, 0) | (1 << slot)
+        client_busy[client] = client_busy.get(client, 0) | (1 << slot)
+        placed.append((client, slot))
+        cadence_count += 1
+        floor = slot + 1
+    return placed
+
+
+def _randomize_shard(job) -> list[list[tuple[str, int]]]:
+    """Fill one day for every buyer of the plan, in order (runs in a worker process)."""
+    plan, buyer_busy, client_busy, clients, appts_before_rest, rest_slots = job
+    return [_fill_day(window, buyer_busy, client_busy, buyer, clients, appts_before_rest, rest_slots)
+            for buyer, window in plan]
+
+
+class AppointmentTable:
+    """Appointments as parallel columns (struct of arrays).
+
+    Buyers and clients are codes into the schedule's name tables, the day a code into its day
+    table, the time a slot index and the locked flag one byte, next to the stable appointment
+    ID: about 19 bytes per appointment instead of a dict holding four strings. Reading rows
+    yields plain appointment dicts, so the table stands in for the old list (len, indexing,
+    iteration, truthiness); `column()` gives NumPy copies for vectorized work. IDs only grow,
+    so the ID column is sorted and `position()` is a binary search.
+    """
+
+    COLUMNS = (("ids", "q"), ("buyer", "i"), ("client", "i"), ("day", "b"), ("slot", "b"), ("locked", "b"))
+    ROW = ("buyer", "client", "day", "slot", "locked")
+
+    def __init__(self, names: tuple):
+        self.names = names  # (buyer names, client names, day names); shared and append-only
+        for col, typecode in self.COLUMNS:
+            setattr(self, col, array(typecode))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.record(*self.row(i))
+
+    def __iter__(self):
+        record = self.record
+        for row in zip(self.buyer, self.client, self.day, self.slot, self.locked):
+            yield record(*row)
+
+    def __repr__(self) -> str:
+        return f"<AppointmentTable: {len(self)} appointments>"
+
+    def record(self, b: int, c: int, d: int, s: int, locked: int) -> dict:
+        buyers, clients, days = self.names
+        return {"client": clients[c], "buyer": buyers[b], "day": days[d], "time": HOURS[s], "locked": bool(locked)}
+
+    def row(self, i: int) -> tuple:
+        return self.buyer[i], self.client[i], self.day[i], self.slot[i], self.locked[i]
+
+    def append(self, aid: int, row: tuple):
+        self.ids.append(aid)
+        for col, value in zip(self.ROW, row):
+            getattr(self, col).append(value)
+
+    def insert(self, i: int, aid: int, row: tuple):
+        self.ids.insert(i, aid)
+        for col, value in zip(self.ROW, row):
+            getattr(self, col).insert(i, value)
+
+    def put(self, i: int, row: tuple):
+        for col, value in zip(self.ROW, row):
+            getattr(self, col)[i] = value
+
+    def position(self, aid: int) -> int:
+        i = bisect_left(self.ids, aid)
+        if i == len(self.ids) or self.ids[i] != aid:
+            raise KeyError(aid)
+        return i
+
+    def column(self, col: str) -> np.ndarray:
+        return np.array(getattr(self, col))
+
+    def keep(self, mask):
+        """Drop the rows where the boolean array `mask` is False."""
+        for col, typecode in self.COLUMNS:
+            setattr(self, col, array(typecode, np.array(getattr(self, col))[mask].tobytes()))
+
+    def copy(self) -> "AppointmentTable":
+        table = AppointmentTable(self.names)
+        for col, _ in self.COLUMNS:
+            setattr(table, col, getattr(self, col)[:])
+        return table
+
+    def to_list(self) -> list[dict]:
+        return list(self)
+
+    def names_of(self, col: str) -> list[str]:
+        """Per-row buyer or client names."""
+        return list(map(self.names[0 if col == "buyer" else 1].__getitem__, getattr(self, col)))
+
+
+class AppointmentsById(Mapping):
+    """Read-only ID -> appointment dict view over an AppointmentTable."""
+
+    def __init__(self, table: AppointmentTable):
+        self._table = table
+
+    def __getitem__(self, aid: int) -> dict:
+        return self._table[self._table.position(aid)]
+
+    def __contains__(self, aid) -> bool:
+        try:
+            self._table.position(aid)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._table.ids)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+def _appointment_keys(*tables) -> list[np.ndarray]:
+    """One int64 key per row of each table, equal for equal appointments (buyer, client, day, slot,
+    locked) even when the tables code names against different name tables."""
+    codes = ({}, {}, {})
+    remaps = [[np.array([codes[side].setdefault(name, len(codes[side])) for name in table.names[side]], np.int64)
+               for side in range(3)] for table in tables]
+    nc, nd = max(len(codes[1]), 1), max(len(codes[2]), 1)
+    keys = []
+    for table, (rb, rc, rd) in zip(tables, remaps):
+        pair = rb[table.column("buyer")] * nc + rc[table.column("client")]
+        slot = (pair * nd + rd[table.column("day")]) * len(HOURS) + table.column("slot")
+        keys.append(slot * 2 + (table.column("locked") != 0))
+    return keys
+
+
+def _unmatched(keys: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Mask of the rows of `keys` left over after pairing equal keys one-to-one with `other`."""
+    def occurrence(k):  # how many earlier rows have the same key
+        order = np.argsort(k, kind="stable")
+        ks = k[order]
+        starts = np.flatnonzero(np.r_[True, ks[1:] != ks[:-1]]) if len(ks) else np.zeros(0, np.int64)
+        rank = np.empty(len(k), np.int64)
+        rank[order] = np.arange(len(k)) - np.repeat(starts, np.diff(np.r_[starts, len(k)]))
+        return rank
+
+    n = max(len(keys), len(other)) + 1
+    return ~np.isin(keys * n + occurrence(keys), other * n + occurrence(other))
+
+
+class Schedule:
+    """Buyers, clients, settings and appointments of one event."""
+
+    def __init__(self, clients=None, buyers=None, appointments=None, **settings):
+        self.version = 0
+        self.appointments_version = 0
+        self._calendar_cache = OrderedDict()
+        self._last_id = 0  # never reset, so a stale ID cannot alias a new appointment
+        self.journal = None  # list of (delta, appointment) changes, enabled by incremental stores
+        self.clients = list(clients or [])
+        self.buyers = list(buyers or [])
+        self.start_hour = settings.get("start_hour", DEFAULT_SETTINGS["start_hour"])
+        self.end_hour = settings.get("end_hour", DEFAULT_SETTINGS["end_hour"])
+        self.lunch_start = settings.get("lunch_start", DEFAULT_SETTINGS["lunch_start"])
+        self.lunch_end = settings.get("lunch_end", DEFAULT_SETTINGS["lunch_end"])
+        self.selected_days = list(settings.get("selected_days", DEFAULT_SETTINGS["selected_days"]))
+        self.time_windows = settings.get("time_windows") or {}  # {buyer: {day: {start,end}}}
+        self._names = ([], [], list(DAYS))  # buyer / client / day names by code (append-only)
+        self._codes = ({}, {}, dict(DAY_OF))  # name -> code, per table
+        self._grids = None
+        self.set_appointments(normalize_appointments(appointments or []))
+
+    def __setattr__(self, name, value):
+        if name in _TRACKED and self.__dict__.get(name) != value:
+            self.__dict__["version"] = self.__dict__.get("version", 0) + 1
+        object.__setattr__(self, name, value)
+
+    # -------------------------
+    # Serialization
+    # -------------------------
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Schedule":
+        sched = cls()
+        sched.update_from_dict(data)
+        return sched
+
+    def update_from_dict(self, data: dict):
+        """Apply a saved/uploaded config; keys missing from `data` keep their current value.
+
+        Older schema versions are migrated first (NewerSchemaError for newer ones); current-version
+        appointments are taken as they are.
+        """
+        data = upgrade(data)
+        self.clients = data.get("clients", self.clients)
+        self.buyers = data.get("buyers", self.buyers)
+        for key in SETTINGS:
+            setattr(self, key, data.get(key, getattr(self, key)))
+        if "appointments" in data:
+            self.set_appointments(data["appointments"])
+
+    def to_dict(self) -> dict:
+        data = {"schema_version": SCHEMA_VERSION, "clients": self.clients, "buyers": self.buyers, "appointments": self.appointments.to_list()}
+        data.update({key: getattr(self, key) for key in SETTINGS})
+        return data
+
+    def snapshot(self) -> dict:
+        """to_dict() with copied containers, safe to serialize while the schedule keeps changing.
+
+        The appointments stay a (copied) AppointmentTable; encoders call its to_list().
+        """
+        data = {"schema_version": SCHEMA_VERSION}
+        data.update({key: getattr(self, key) for key in SETTINGS})
+        data.update(clients=list(self.clients), buyers=list(self.buyers), appointments=self.appointments.copy(),
+                    selected_days=list(self.selected_days), time_windows=copy.deepcopy(self.time_windows))
+        return data
+
+    # -------------------------
+    # Time helpers & constraints
+    # -------------------------
+
+    def _refresh_lunch(self):
+        key = (self.lunch_start, self.lunch_end)
+        if getattr(self, "_lunch_key", None) != key:
+            lo, hi = idx_of(self.lunch_start), idx_of(self.lunch_end)
+            self._lunch_mask = [lo <= i < hi for i in range(len(HOURS))]
+            self._lunch_bits = sum(1 << i for i in range(lo, hi))
+            self._lunch_key = key
+
+    @property
+    def lunch_mask(self) -> list[bool]:
+        """lunch_mask[slot] is True for slots blocked by the lunch break."""
+        self._refresh_lunch()
+        return self._lunch_mask
+
+    @property
+    def lunch_bits(self) -> int:
+        """Lunch break as a slot bitmask."""
+        self._refresh_lunch()
+        return self._lunch_bits
+
+    def is_in_lunch_break(self, t: str) -> bool:
+        return self.lunch_mask[SLOT_OF[t]]
+
+    def day_slots(self) -> range:
+        """Slots shown between the global start and end of the day."""
+        return range(idx_of(self.start_hour), idx_of(self.end_hour))
+
+    def window_for(self, buyer: str, day: str) -> tuple[str, str]:
+        w = self.time_windows.get(buyer, {}).get(day, {})
+        return w.get("start", self.start_hour), w.get("end", self.end_hour)
+
+    def set_time_window(self, buyer: str, day: str, start: str, end: str):
+        window = {"start": start, "end": end}
+        days = self.time_windows.setdefault(buyer, {})
+        if days.get(day) != window:
+            days[day] = window
+            self.version += 1
+
+    def window_mask(self, buyer: str, day: str, interval: int = 30) -> int:
+        """Bookable slots of a buyer's day: buyer window ∩ global window, minus lunch, on the interval grid."""
+        start, end = self.window_for(buyer, day)
+        start_idx = max(idx_of(start), idx_of(self.start_hour))
+        end_idx = min(idx_of(end), idx_of(self.end_hour))
+        step = interval // 30
+        bits = sum(1 << i for i in range(start_idx + (-start_idx) % step, end_idx, step)) if end_idx > start_idx else 0
+        return bits & ~self.lunch_bits
+
+    # -------------------------
+    # Appointments & occupancy
+    # -------------------------
+    # `appointments` is an AppointmentTable; every mutation goes through the methods below so
+    # the busy masks, the double-booking counts and the grids stay in sync. Names are interned
+    # into codes once per schedule (append-only tables, shared with the grids).
+
+    def _code(self, side: int, name) -> int:
+        """Code of a buyer (0), client (1) or day (2) name, interning it on first use."""
+        code = self._codes[side].get(name)
+        if code is None:
+            code = self._codes[side][name] = len(self._names[side])
+            self._names[side].append(name)
+            if side < 2 and self._grids is not None:
+                self._grow_grids(side)
+        return code
+
+    def _encode(self, a: dict) -> tuple:
+        """(buyer, client, day, slot, locked) codes of an appointment dict."""
+        return (self._code(0, a["buyer"]), self._code(1, a["client"]), self._code(2, a["day"]),
+                SLOT_OF[a["time"]], int(bool(a.get("locked"))))
+
+    def _occupy(self, row: tuple, delta: int):
+        self.version += 1
+        self.appointments_version += 1
+        if self.journal is not None:
+            self.journal.append((delta, self.appointments.record(*row)))
+        b, c, d, s, _ = row
+        day, bit = self._names[2][d], 1 << s
+        for side, masks, code in ((0, self.buyer_busy, b), (1, self.client_busy, c)):
+            key, cell = (day, self._names[side][code]), (side, d, s, code)
+            mask = masks.get(key, 0)
+            if delta > 0:
+                if mask & bit:
+                    self._overbooked[cell] = self._overbooked.get(cell, 0) + 1
+                else:
+                    masks[key] = mask | bit
+            elif cell in self._overbooked:
+                # a double booking is left in this cell; let the grids rebuild on next use
+                self._overbooked[cell] -= 1
+                if not self._overbooked[cell]:
+                    del self._overbooked[cell]
+                self._grids = None
+            else:
+                masks[key] = mask & ~bit
+        if self._grids is not None and d < len(DAYS):
+            self._grid_put(row, delta > 0)
+
+    def rebuild_occupancy(self):
+        """Rebuild busy masks and double-booking counts from the columns (after load / bulk replacement)."""
+        self.buyer_busy = {}  # (day, buyer) -> busy slot bitmask
+        self.client_busy = {}  # (day, client) -> busy slot bitmask
+        self._overbooked = {}  # (side, day code, slot, code) -> bookings beyond the first
+        self._grids = None
+        table = self.appointments
+        if not table:
+            return
+        n_slots = len(HOURS)
+        day, slot = table.column("day").astype(np.int64), table.column("slot").astype(np.int64)
+        for side, masks, col in ((0, self.buyer_busy, "buyer"), (1, self.client_busy, "client")):
+            names, day_names = self._names[side], self._names[2]
+            width = max(len(names), 1)
+            # one sorted pass: cell = (day, participant, slot); repeated cells are double bookings
+            cells, counts = np.unique((day * width + table.column(col)) * n_slots + slot, return_counts=True)
+            pairs = cells // n_slots
+            dup = counts > 1
+            if dup.any():
+                self._overbooked.update(zip(
+                    zip(itertools.repeat(side), (pairs[dup] // width).tolist(), (cells[dup] % n_slots).tolist(),
+                        (pairs[dup] % width).tolist()),
+                    (counts[dup] - 1).tolist()))
+            starts = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+            bits = np.bitwise_or.reduceat(np.left_shift(np.int64(1), cells % n_slots), starts)
+            keys = zip(map(day_names.__getitem__, (pairs[starts] // width).tolist()),
+                       map(names.__getitem__, (pairs[starts] % width).tolist()))
+            masks.update(zip(keys, bits.tolist()))
+
+    def set_appointments(self, appts: list[dict]):
+        table = AppointmentTable(self._names)
+        for aid, a in enumerate(appts, start=self._last_id + 1):
+            table.append(aid, self._encode(a))
+        self._install(table)
+
+    def set_appointment_columns(self, names: tuple, columns: dict):
+        """Replace the appointments from columns coded against `names` (buyer, client, day name lists).
+
+        Bulk load path for binary snapshots: codes are remapped onto this schedule's name
+        tables in one vectorized step; raises ValueError on out-of-range codes.
+        """
+        n = len(columns["slot"])
+        table = AppointmentTable(self._names)
+        for side, col, typecode in ((0, "buyer", "i"), (1, "client", "i"), (2, "day", "b")):
+            codes = np.asarray(columns[col], np.int64)
+            if n and (codes.min() < 0 or codes.max() >= len(names[side])):
+                raise ValueError(f"{col} code out of range")
+            remap = np.array([self._code(side, name) for name in names[side]], np.int64)
+            setattr(table, col, array(typecode, remap[codes].astype(np.dtype(typecode)).tobytes()))
+        slot, locked = np.asarray(columns["slot"], np.int64), np.asarray(columns["locked"])
+        if n and (slot.min() < 0 or slot.max() >= len(HOURS)):
+            raise ValueError("slot out of range")
+        table.slot = array("b", slot.astype(np.int8).tobytes())
+        table.locked = array("b", (locked != 0).astype(np.int8).tobytes())
+        table.ids = array("q", np.arange(self._last_id + 1, self._last_id + 1 + n, dtype=np.int64).tobytes())
+        self._install(table)
+
+    def _install(self, table: "AppointmentTable"):
+        self._last_id += len(table)
+        self.appointments = table
+        self.version += 1
+        self.appointments_version += 1
+        if self.journal is not None:
+            self.journal[:] = [(0, None)]  # (0, None): replace everything with what follows
+        self.rebuild_occupancy()
+
+    def add_appointment(self, a: dict) -> int:
+        """Append `a`; returns its appointment ID."""
+        self._last_id = aid = self._last_id + 1
+        row = self._encode(a)
+        self.appointments.append(aid, row)
+        self._occupy(row, 1)
+        return aid
+
+    def add_appointments(self, appts: list[dict]) -> list[int]:
+        """Append all of `appts` (each is encoded before any is added); returns their IDs."""
+        rows = [self._encode(a) for a in appts]
+        first = self._last_id + 1
+        for aid, row in enumerate(rows, start=first):
+            self.appointments.append(aid, row)
+            self._occupy(row, 1)
+        self._last_id += len(rows)
+        return list(range(first, first + len(rows)))
+
+    def replace_appointment(self, idx: int, a: dict):
+        row = self._encode(a)
+        self._occupy(self.appointments.row(idx), -1)
+        self.appointments.put(idx, row)
+        self._occupy(row, 1)
+
+    def update_appointment(self, aid: int, a: dict):
+        """Replace the appointment with ID `aid`, keeping the ID."""
+        self.replace_appointment(self.appointments.position(aid), a)
+
+    @property
+    def by_id(self) -> "AppointmentsById":
+        """Read-only mapping appointment ID -> appointment dict, in creation order."""
+        return AppointmentsById(self.appointments)
+
+    def _remove_rows(self, remove):
+        """Remove the rows where the boolean array `remove` is set."""
+        table = self.appointments
+        for i in np.flatnonzero(remove).tolist():
+            self._occupy(table.row(i), -1)
+        table.keep(~remove)
+
+    def remove_appointment(self, aid: int) -> dict:
+        """Remove the appointment with ID `aid` and return it (KeyError if there is none)."""
+        i = self.appointments.position(aid)
+        a = self.appointments[i]
+        remove = np.zeros(len(self.appointments), bool)
+        remove[i] = True
+        self._remove_rows(remove)
+        return a
+
+    def restore_appointment(self, aid: int, a: dict):
+        """Put back an appointment taken out with `remove_appointment()`, under its old ID and at its old place."""
+        table = self.appointments
+        i = bisect_left(table.ids, aid)
+        if i < len(table) and table.ids[i] == aid:
+            raise ValueError(f"appointment {aid} exists")
+        row = self._encode(a)
+        table.insert(i, aid, row)
+        self._occupy(row, 1)
+
+    def remove_appointments(self, predicate):
+        """Remove every appointment for which predicate(a) is true."""
+        self._remove_rows(np.fromiter((bool(predicate(a)) for a in self.appointments), bool, len(self.appointments)))
+
+    def sync_appointments(self, table: AppointmentTable) -> tuple:
+        """Make the appointments equal to `table`'s (compared as a multiset), changing only the difference.
+
+        Rows on both sides keep their position and ID, so reloading a file does not renumber
+        them; rows only in `table` are appended in its order. Returns (added IDs, removed
+        appointment dicts).
+        """
+        mine, theirs = _appointment_keys(self.appointments, table)
+        gone = _unmatched(mine, theirs)
+        removed = [self.appointments[i] for i in np.flatnonzero(gone).tolist()]
+        if removed:
+            self._remove_rows(gone)
+        return self.add_appointments([table[i] for i in np.flatnonzero(_unmatched(theirs, mine)).tolist()]), removed
+
+    def merge_appointments(self, base: AppointmentTable, ours: AppointmentTable):
+        """Three-way merge: apply what changed from `base` to `ours` on top of these appointments.
+
+        Appointments `ours` removed are removed here (one matching row each, if still present)
+        and the ones it added are appended, except those also added here since `base` (both sides
+        booked the same meeting: it is kept once); everything else is left as it is.
+        """
+        mine, base_keys, our_keys = _appointment_keys(self.appointments, base, ours)
+        added_here = mine[_unmatched(mine, base_keys)]
+        drop = ~_unmatched(mine, base_keys[_unmatched(base_keys, our_keys)])
+        if drop.any():
+            self._remove_rows(drop)
+        added = np.flatnonzero(_unmatched(our_keys, base_keys))
+        added = added[_unmatched(our_keys[added], added_here)]
+        self.add_appointments([ours[i] for i in added.tolist()])
+
+    def find_appointments(self, buyer: str = None, client: str = None, day: str = None, time: str = None) -> list[int]:
+        """IDs of the appointments matching every given field, in creation order."""
+        table = self.appointments
+        match = np.ones(len(table), bool)
+        for col, side, value in (("buyer", 0, buyer), ("client", 1, client), ("day", 2, day)):
+            if value:
+                code = self._codes[side].get(value)
+                if code is None:
+                    return []
+                match &= table.column(col) == code
+        if time:
+            match &= table.column("slot") == SLOT_OF[time]
+        return table.column("ids")[match].tolist()
+
+    def drop_lunch_appointments(self):
+        """Remove any appointment accidentally saved during lunch (one vectorized test when there is none)."""
+        if self.appointments:
+            lunch = np.array(self.lunch_mask)[self.appointments.column("slot")]
+            if lunch.any():
+                self._remove_rows(lunch)
+
+    def slot_free(self, client: str, buyer: str, day: str, slot: int) -> bool:
+        busy = self.buyer_busy.get((day, buyer), 0) | self.client_busy.get((day, client), 0)
+        return not (busy >> slot) & 1
+
+    def is_slot_free(self, client: str, buyer: str, day: str, time: str) -> bool:
+        """Slot is free if no appointment exists for same day/time with either buyer or client."""
+        return self.slot_free(client, buyer, day, SLOT_OF[time])
+
+    def common_free_mask(self, client: str, buyer: str, day: str, interval: int = 30) -> int:
+        """Slots of the buyer's window where both the buyer and the client are free."""
+        busy = self.buyer_busy.get((day, buyer), 0) | self.client_busy.get((day, client), 0)
+        return self.window_mask(buyer, day, interval) & ~busy
+
+    # -------------------------
+    # Occupancy grids (NumPy)
+    # -------------------------
+    # occ_b[day, slot, buyer_code] = client_code and occ_c[day, slot, client_code] = buyer_code
+    # (-1 when free), with lock_b / lock_c holding the locked flag. The participant axis
+    # follows the name tables and grows by doubling. A double-booked cell keeps only one of its
+    # bookings; views list them all through `overbooked_cells()`.
+
+    def grids(self):
+        """Return [occ_b, lock_b, occ_c, lock_c], building them on first use."""
+        if self._grids is None:
+            self.buyer_ids(self.buyers)
+            self.client_ids(self.clients)
+            cap = max(len(self._names[0]), len(self._names[1]), 1)
+            shape = (len(DAYS), len(HOURS), cap)
+            occ_b, lock_b, occ_c, lock_c = self._grids = [np.full(shape, -1, np.int32), np.zeros(shape, bool),
+                                                          np.full(shape, -1, np.int32), np.zeros(shape, bool)]
+            table = self.appointments
+            if table:
+                day, slot = table.column("day"), table.column("slot")
+                b, c, locked = table.column("buyer"), table.column("client"), table.column("locked").astype(bool)
+                on_grid = day < len(DAYS)
+                day, slot, b, c, locked = day[on_grid], slot[on_grid], b[on_grid], c[on_grid], locked[on_grid]
+                occ_b[day, slot, b] = c
+                occ_c[day, slot, c] = b
+                lock_b[day, slot, b] = locked
+                lock_c[day, slot, c] = locked
+        return self._grids
+
+    def _grow_grids(self, side: int):
+        cap = self._grids[2 * side].shape[2]
+        if len(self._names[side]) <= cap:
+            return
+        while cap < len(self._names[side]):
+            cap *= 2
+        for k in (2 * side, 2 * side + 1):
+            g = self._grids[k]
+            pad = np.full(g.shape[:2] + (cap - g.shape[2],), -1 if g.dtype != bool else False, g.dtype)
+            self._grids[k] = np.concatenate([g, pad], axis=2)
+
+    def is_overbooked(self, side: int, day: int, slot: int, code: int) -> bool:
+        """True if the buyer (side 0) or client (side 1) grid cell holds more than one booking."""
+        return (side, day, slot, code) in self._overbooked
+
+    def overbooked_cells(self, side: int) -> dict:
+        """{(day, slot, code): [(other code, locked), ...]} for the buyer (side 0) or client (side 1)
+        cells holding more than one booking, read from the columns in table order (the grids keep
+        only one booking per cell)."""
+        wanted = [cell[1:] for cell in self._overbooked if cell[0] == side]
+        out = {}
+        if not wanted:
+            return out
+        own, other = ("buyer", "client") if side == 0 else ("client", "buyer")
+        table = self.appointments
+        day, slot, code = (table.column(name).astype(np.int64) for name in ("day", "slot", own))
+        width = max(len(self._names[side]), 1)
+        key = (day * len(HOURS) + slot) * width + code
+        rows = np.flatnonzero(np.isin(key, [(d * len(HOURS) + s) * width + c for d, s, c in wanted]))
+        others, locked = table.column(other)[rows].tolist(), table.column("locked")[rows].astype(bool).tolist()
+        for cell, partner, lock in zip(zip(day[rows].tolist(), slot[rows].tolist(), code[rows].tolist()), others, locked):
+            out.setdefault(cell, []).append((partner, lock))
+        return out
+
+    def buyer_ids(self, names) -> list[int]:
+        return [self._code(0, name) for name in names]
+
+    def client_ids(self, names) -> list[int]:
+        return [self._code(1, name) for name in names]
+
+    def id_names(self):
+        """(buyer names, client names) indexed by grid id."""
+        return self._names[0], self._names[1]
+
+    def _grid_put(self, row: tuple, booked: bool):
+        b, c, day, slot, locked = row
+        occ_b, lock_b, occ_c, lock_c = self._grids
+        occ_b[day, slot, b] = c if booked else -1
+        occ_c[day, slot, c] = b if booked else -1
+        lock_b[day, slot, b] = lock_c[day, slot, c] = booked and bool(locked)
+
+    # -------------------------
+    # Randomizer with heuristics
+    # -------------------------
+
+    def gen_slots_for(self, buyer: str, day: str, interval: int = 30) -> list[int]:
+        """Return ordered list of slot indexes honoring buyer's day window, global window, lunch and interval."""
+        return list(iter_slots(self.window_mask(buyer, day, interval)))
+
+    def remove_unlocked_appointments_for(self, buyers: list[str]):
+        """Remove only unlocked (non-locked) appointments that involve selected buyers across all days."""
+        buyers = set(buyers)
+        self.remove_appointments(lambda a: a["buyer"] in buyers and not a.get("locked", False))
+
+    def place_for_day(self, buyer: str, day: str, clients_for_day: list[str], interval: int = 30,
+                      appts_before_rest: int = 2, rest_slots: int = 1) -> int:
+        """Place clients on that day respecting rest cadence and existing locked blocks."""
+        buyer_busy = {buyer: self.buyer_busy.get((day, buyer), 0)}
+        client_busy = {c: self.client_busy.get((day, c), 0) for c in clients_for_day}
+        placed = _fill_day(self.window_mask(buyer, day, interval), buyer_busy, client_busy, buyer,
+                           clients_for_day, appts_before_rest, rest_slots)
+        for client, slot in placed:
+            self.add_appointment({"client": client, "buyer": buyer, "day": day, "time": HOURS[slot], "locked": False})
+        return len(placed)
+
+    def randomize(self, buyers: list[str], clients: list[str], interval: int = 30,
+                  appts_before_rest: int = 2, rest_slots: int = 1, workers: int = 1) -> int:
+        """Reflow the unlocked appointments of `buyers` with `clients`, balanced over the selected days.
+
+        Every buyer gets the same day plan (`split_by_day`), and buyers only compete within a
+        day, so each day is an independent shard seeded with the busy masks left after the
+        unlocked appointments are removed. With `workers` > 1 and a large selection the shards
+        run on a process pool; the merge is the same either way.
+        """
+        # remove previous unlocked appointments for the selected buyers so we can reflow
+        self.remove_unlocked_appointments_for(buyers)
+        days_pool = self.selected_days[:]
+        if not buyers or not clients or not days_pool:
+            return 0
+        day_lists = split_by_day(clients, days_pool)
+        jobs = []
+        for d in days_pool:
+            plan = [(b, self.window_mask(b, d, interval)) for b in buyers] if day_lists[d] else []
+            buyer_busy = {b: self.buyer_busy.get((d, b), 0) for b in buyers}
+            client_busy = {c: self.client_busy.get((d, c), 0) for c in day_lists[d]}
+            jobs.append((plan, buyer_busy, client_busy, day_lists[d], appts_before_rest, rest_slots))
+
+        if workers > 1 and len(jobs) > 1 and len(buyers) * len(clients) >= PARALLEL_MIN_PAIRS:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                shards = list(pool.map(_randomize_shard, jobs))
+        else:
+            shards = [_randomize_shard(job) for job in jobs]
+
+        # merge buyer by buyer, day by day: the same appointment order as filling buyers in turn
+        placed = 0
+        for i, buyer in enumerate(buyers):
+            for d, shard in zip(days_pool, shards):
+                for client, slot in shard[i] if shard else ():
+                    self.add_appointment({"client": client, "buyer": buyer, "day": d, "time": HOURS[slot], "locked": False})
+                    placed += 1
+        return placed
+
+
+# -------------------------
+# Persistence
+# -------------------------
+
+def load_schedule(path: str) -> Schedule:
+    """Read a data file (JSON, snapshot or SQLite) into a new Schedule."""
+    from ubagofish_storage import open_store
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    sched = Schedule()
+    store = open_store(path)
+    try:
+        store.load(sched)
+    finally:
+        store.close()
+    sched.drop_lunch_appointments()
+    return sched
+
+
+def save_schedule(sched: Schedule, path: str):
+    """Write `sched` to a data file (atomic, locked) through the storage layer."""
+    from ubagofish_storage import open_store
+
+    store = open_store(path)
+    try:
+        store.save(sched)
+    finally:
+        store.close()
+
+
+# -------------------------
+# Export builders
+# -------------------------
+
+def calendar_frame(sched: Schedule):
+    """DataFrame for the calendar view: one column per day, one row per visible time.
+
+    Memoized per schedule on (appointments_version, day window, lunch); the returned frame is
+    shared between calls and must not be modified.
+    """
+    key = (sched.appointments_version, sched.start_hour, sched.end_hour, sched.lunch_start, sched.lunch_end)
+    cache = sched._calendar_cache
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    df = cache[key] = _build_calendar_frame(sched)
+    while len(cache) > CALENDAR_CACHE_SIZE:
+        cache.popitem(last=False)
+    return df
+
+
+def _build_calendar_frame(sched: Schedule):
+    import pandas as pd
+
+    occ_b, lock_b, _, _ = sched.grids()
+    buyer_names, client_names = (np.array(n, dtype=object) for n in sched.id_names())
+    slots = np.arange(sched.day_slots().start, sched.day_slots().stop)
+    sub = occ_b[:, slots, :]
+    day, row, b = np.nonzero(sub >= 0)  # C order: sorted by (day, row, buyer)
+    labels = buyer_names[b] + " - " + client_names[sub[day, row, b]] + np.where(lock_b[:, slots, :][day, row, b], " 🔒", "")
+    # a double-booked buyer cell shows every one of its meetings, not just the one the grid kept
+    overbooked = sched.overbooked_cells(0)
+    if overbooked and len(slots):
+        entry = (day * len(slots) + row) * occ_b.shape[2] + b
+        for (d, s, code), meetings in overbooked.items():
+            if d < len(DAYS) and slots[0] <= s <= slots[-1]:
+                i = np.searchsorted(entry, (d * len(slots) + s - slots[0]) * occ_b.shape[2] + code)
+                labels[i] = "; ".join(f"{buyer_names[code]} - {client_names[c]}{' 🔒' if lock else ''}"
+                                      for c, lock in meetings)
+    cells = np.full(len(DAYS) * len(slots), "", dtype=object)
+    if len(labels):
+        cell = day * len(slots) + row
+        uniq, starts = np.unique(cell, return_index=True)
+        cells[uniq] = ["; ".join(group) for group in np.split(labels, starts[1:])]
+    grid = cells.reshape(len(DAYS), len(slots)).T
+    grid[np.array(sched.lunch_mask, bool)[slots]] = "LUNCH BREAK"
+    df = pd.DataFrame(grid, index=[HOURS[i] for i in slots], columns=DAYS, dtype=object)
+    df.columns.name = "Hora"
+    return df
@@ -0,0 +1,163 @@
+"""
+Ubagofish Scheduler — event registry
+One data file per event (fair) under an events directory, plus a small `index.json` with each
+event's metadata (name, dates, counts). The app lists every event from the index alone and
+loads only the active one, so memory and switching cost follow the size of that event, not
+of the archive.
+
+Notes:
+- Event files are opened through `ubagofish_storage.open_store`; new events use `ext`
+  (snapshots by default) and keep their file name in the index, so changing `ext` later does
+  not orphan older events.
+- The index is re-read only when its (mtime, size, inode) changes and is updated
+  read-modify-write under the exclusive lock of `ubagofish_storage.file_lock`, so several
+  sessions can share one directory.
+- `sync()` writes an event's counts back to the index only when they changed.
+"""
+
+import json
+import os
+import re
+import time
+import unicodedata
+
+from ubagofish_engine import Schedule
+from ubagofish_storage import atomic_write, file_lock, open_store
+
+INDEX_FILE = "index.json"
+EVENT_EXT = ".ubs"
+
+
+def slugify(name: str) -> str:
+    """File-system friendly id for an event name ("Feria Vigo 2025" -> "feria-vigo-2025")."""
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "evento"
+
+
+def event_counts(sched: Schedule) -> dict:
+    """Index metadata derived from a loaded schedule."""
+    return {"appointments": len(sched.appointments), "buyers": len(sched.buyers),
+            "clients": len(sched.clients), "days": list(sched.selected_days)}
+
+
+class EventRegistry:
+    """Events stored under `root`: metadata from the index, schedules only through `open()`."""
+
+    def __init__(self, root: str, ext: str = EVENT_EXT, lock_timeout: float = 5.0):
+        self.root = root
+        self.ext = ext
+        self.lock_timeout = lock_timeout
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._events = {}  # slug -> metadata, in creation order
+        self._active = None
+        self._stat = None  # (mtime_ns, size, inode) of the index as last read or written
+        os.makedirs(root, exist_ok=True)
+
+    def events(self) -> dict:
+        """slug -> metadata ({"name", "file", "start", "end", "created", "updated", counts...})."""
+        self._refresh()
+        return dict(self._events)
+
+    def get(self, slug: str) -> dict:
+        self._refresh()
+        return self._events[slug]
+
+    @property
+    def active(self):
+        """Slug of the most recently opened event (None for an empty registry)."""
+        self._refresh()
+        return self._active if self._active in self._events else next(iter(self._events), None)
+
+    def path(self, slug: str) -> str:
+        return os.path.join(self.root, self.get(slug)["file"])
+
+    def open(self, slug: str):
+        """Store for the event's data file; load it into a Schedule to work on the event."""
+        return open_store(self.path(slug))
+
+    def create(self, name: str, start: str = None, end: str = None) -> str:
+        """Register a new, empty event; returns its slug."""
+        name = name.strip()
+        if not name:
+            raise ValueError("event name is empty")
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+        def add(events, doc):
+            base = slug = slugify(name)
+            n = 2
+            while slug in events or os.path.exists(os.path.join(self.root, slug + self.ext)):
+                slug, n = f"{base}-{n}", n + 1
+            events[slug] = {"name": name, "file": slug + self.ext, "start": start, "end": end,
+                            "created": now, "updated": now, **event_counts(Schedule())}
+            return slug
+
+        return self._update(add)
+
+    def import_file(self, path: str, name: str) -> str:
+        """Copy an existing data file (any store format or schema version) into a new event."""
+        sched = Schedule()
+        source = open_store(path)
+        try:
+            source.load(sched)
+        finally:
+            source.close()
+        slug = self.create(name)
+        store = self.open(slug)
+        try:
+            store.save(sched)
+        finally:
+            store.close()
+        self.sync(slug, sched)
+        return slug
+
+    def set_active(self, slug: str):
+        self._refresh()
+        if self._active != slug:
+            self._update(lambda events, doc: doc.__setitem__("active", slug))
+
+    def sync(self, slug: str, sched: Schedule) -> bool:
+        """Record the event's current counts in the index; False when they were unchanged."""
+        counts = event_counts(sched)
+        meta = self.get(slug)
+        if all(meta.get(k) == v for k, v in counts.items()):
+            return False
+
+        def store_counts(events, doc):
+            if slug in events:
+                events[slug].update(counts, updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+        self._update(store_counts)
+        return True
+
+    def _read(self) -> tuple:
+        try:
+            with open(self.index_path, "rb") as f:
+                doc = json.load(f)
+                st = os.fstat(f.fileno())
+        except FileNotFoundError:
+            return {"events": {}, "active": None}, None
+        return doc, (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            self._events, self._active, self._stat = {}, None, None
+            return
+        if (st.st_mtime_ns, st.st_size, st.st_ino) == self._stat:
+            return
+        with file_lock(self.index_path, shared=True, timeout=self.lock_timeout):
+            doc, self._stat = self._read()
+        self._events, self._active = doc.get("events", {}), doc.get("active")
+
+    def _update(self, change):
+        """Apply `change(events, doc)` to the freshest index and write it back; returns its result."""
+        with file_lock(self.index_path, timeout=self.lock_timeout):
+            doc, _ = self._read()
+            events = doc.setdefault("events", {})
+            result = change(events, doc)
+            atomic_write(self.index_path, json.dumps(doc, indent=2, ensure_ascii=False).encode("utf-8"))
+            st = os.stat(self.index_path)
+        self._events, self._active = events, doc.get("active")
+        self._stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return result
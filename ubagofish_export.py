@@ -0,0 +1,123 @@
+"""
+Ubagofish Scheduler — Excel export
+Streams the schedule workbook with openpyxl's write-only mode: every cell is written once,
+already styled (blue headers, thin borders, lunch slots greyed out), and column widths are
+set before the first row. Nothing is reloaded or restyled afterwards, so memory stays flat
+as events grow.
+
+Sheets:
+- `ByBuyer_{day}` / `ByClient_{day}` for each selected day (locked appointments marked `*`).
+- `Summary_Clients` / `Summary_Buyers` with the appointment count per participant.
+"""
+
+from collections import Counter
+from copy import copy
+from io import BytesIO
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from ubagofish_engine import DAY_OF, HOURS, Schedule
+
+HEADER_FILL = PatternFill("solid", fgColor="305496")
+HEADER_FONT = Font(color="FFFFFF", bold=True, name="Calibri", size=11)
+LUNCH_FILL = PatternFill("solid", fgColor="D9D9D9")
+CENTER = Alignment(horizontal="center", vertical="center")
+THIN = Side(style="thin")
+BORDER = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+LUNCH = "LUNCH BREAK"
+
+
+class _SheetWriter:
+    """Appends pre-styled rows to a write-only worksheet."""
+
+    def __init__(self, wb: Workbook, title: str, header: list[str], widths: list[float]):
+        self.ws = wb.create_sheet(title)
+        for i, width in enumerate(widths, start=1):
+            self.ws.column_dimensions[get_column_letter(i)].width = width
+        # one template per look; cells copy its style array instead of setting
+        # font/fill/border/alignment one by one
+        self._header = self._template(fill=HEADER_FILL, font=HEADER_FONT, alignment=CENTER)
+        self._body = self._template(alignment=CENTER, border=BORDER)
+        self._lunch = self._template(alignment=CENTER, border=BORDER, fill=LUNCH_FILL)
+        self.ws.append([self._cell(v, self._header) for v in header])
+
+    def _template(self, **style) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.ws)
+        for attr, value in style.items():
+            setattr(cell, attr, value)
+        return cell
+
+    def _cell(self, value, template: WriteOnlyCell) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.ws, value)
+        cell._style = copy(template._style)
+        return cell
+
+    def row(self, values):
+        self.ws.append([self._cell(v, self._lunch if v == LUNCH else self._body) for v in values])
+
+
+def _width(names: list[str], minimum: float = 10, maximum: float = 40) -> list[float]:
+    return [min(max(minimum, len(str(n)) + 2), maximum) for n in names]
+
+
+def sheet_grid(occ, lock, day: int, slots, cols: list[int], other_names: list[str], lunch_rows,
+               overbooked: dict = None):
+    """Rows = slots, columns = participants; cells hold the other side's name (`*` if locked).
+
+    `overbooked` is `Schedule.overbooked_cells()` for the same side: those cells list every
+    booking ("A; B") instead of the one the grid keeps.
+    """
+    names = np.array(other_names + [""], dtype=object)  # id -1 maps to ""
+    ids = occ[day, slots][:, cols]
+    vals = names[ids]
+    vals = np.where(lock[day, slots][:, cols], vals + "*", vals)
+    vals[lunch_rows[:, None] & (ids < 0)] = LUNCH
+    if overbooked and len(slots):
+        col_of = {code: j for j, code in enumerate(cols)}
+        for (d, s, code), bookings in overbooked.items():
+            if d == day and slots[0] <= s <= slots[-1] and code in col_of:
+                vals[s - slots[0], col_of[code]] = "; ".join(other_names[o] + ("*" if locked else "")
+                                                             for o, locked in bookings)
+    return vals
+
+
+def export_excel(sched: Schedule) -> BytesIO:
+    """Workbook with ByBuyer_{day} / ByClient_{day} sheets per selected day plus summaries."""
+    slots = np.arange(sched.day_slots().start, sched.day_slots().stop)
+    times = [HOURS[i] for i in slots]
+    lunch_rows = np.array(sched.lunch_mask, bool)[slots]
+    buyers = sched.buyers[:]
+    clients = sched.clients[:]
+    buyer_cols, client_cols = sched.buyer_ids(buyers), sched.client_ids(clients)
+    occ_b, lock_b, occ_c, lock_c = sched.grids()
+    buyer_names, client_names = sched.id_names()
+    over_b, over_c = sched.overbooked_cells(0), sched.overbooked_cells(1)
+
+    wb = Workbook(write_only=True)
+    for day in sched.selected_days:
+        for kind, occ, lock, cols, names, other, over in (
+            ("ByBuyer", occ_b, lock_b, buyer_cols, buyers, client_names, over_b),
+            ("ByClient", occ_c, lock_c, client_cols, clients, buyer_names, over_c),
+        ):
+            grid = sheet_grid(occ, lock, DAY_OF[day], slots, cols, other, lunch_rows, over)
+            sheet = _SheetWriter(wb, f"{kind}_{day}", ["Time"] + names, [8] + _width(names))
+            for t, values in zip(times, grid.tolist()):
+                sheet.row([t] + values)
+
+    # summary sheets
+    if sched.appointments:
+        for title, key, label in (("Summary_Clients", "client", "Client"), ("Summary_Buyers", "buyer", "Buyer")):
+            counts = Counter(sched.appointments.names_of(key))
+            names = sorted(counts)
+            sheet = _SheetWriter(wb, title, [label, "Count"], [max(_width(names, minimum=12)), 8])
+            for name in names:
+                sheet.row([name, counts[name]])
+
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,148 @@
+"""
+Ubagofish Scheduler — config import
+Incremental reader for uploaded config/event JSON files. The document is decoded chunk by
+chunk; top-level keys are parsed one value at a time and the `appointments` array one
+element at a time, migrated to the current schema and validated in batches, so a large
+event export never has to be held as one parsed tree and the caller can report progress
+between batches.
+
+Notes:
+- `fingerprint()` hashes the raw upload; the app uses it to apply each upload once.
+- Appointments without a client/buyer or with an unknown day/time are dropped and counted
+  in `rejected` instead of failing the whole import.
+"""
+
+import codecs
+import hashlib
+import json
+
+from ubagofish_engine import DAY_OF, SLOT_OF
+from ubagofish_schema import schema_version, upgrade_appointments
+
+CHUNK_SIZE = 1 << 16
+BATCH_SIZE = 5000
+_WS = " \t\n\r"
+_AFTER_VALUE = _WS + ",:]}"  # what may follow a complete value in valid JSON
+_DECODER = json.JSONDecoder()
+
+
+def fingerprint(payload) -> str:
+    """Content hash of an upload (bytes or buffer)."""
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class _Reader:
+    """JSON values pulled one at a time from a binary file, refilling the buffer on demand."""
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self):
+        if self.eof:
+            return
+        # read at least as much as is pending, so a value spanning many chunks is re-scanned
+        # only O(log n) times
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.bytes_read += len(chunk)
+        if self.pos > self.chunk_size:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += self.decoder.decode(chunk, final=not chunk)
+        self.eof = not chunk
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at the end of the input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"invalid JSON near byte {self.bytes_read}: expected one of {chars!r}, got {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # "1." or "12" may be cut-off numbers: only trust a value followed by a delimiter
+                if self.eof or (end < len(self.buf) and self.buf[end] in _AFTER_VALUE):
+                    self.pos = end
+                    return value
+            self._fill()
+
+
+def _validate(batch: list, out: list, version: int) -> int:
+    """Upgrade `batch` from schema `version` into `out`; returns how many entries were rejected."""
+    good = [a for a in upgrade_appointments(batch, version)
+            if isinstance(a, dict) and a.get("client") and a.get("buyer")
+            and a.get("day") in DAY_OF and a.get("time") in SLOT_OF]
+    out.extend(good)
+    return len(batch) - len(good)
+
+
+def read_config(f, total_size: int = None, batch_size: int = BATCH_SIZE, progress=None,
+                chunk_size: int = CHUNK_SIZE):
+    """Parse a config JSON document from the binary file `f` incrementally.
+
+    Returns (data, appointments, rejected): `data` holds every top-level key except
+    "appointments" (still in the document's schema; `Schedule.update_from_dict()` migrates it);
+    `appointments` is the upgraded, validated list (None when the document has no such key). `progress(fraction)` is called between batches when `total_size` is known.
+    """
+    r = _Reader(f, chunk_size)
+    data, appointments, rejected = {}, None, 0
+
+    def report():
+        if progress is not None and total_size:
+            progress(min(1.0, r.bytes_read / total_size))
+
+    r.expect("{")
+    if r.peek() == "}":
+        r.pos += 1
+        return data, appointments, rejected
+    while True:
+        key = r.value()
+        if not isinstance(key, str):
+            raise ValueError(f"invalid JSON near byte {r.bytes_read}: object keys must be strings")
+        r.expect(":")
+        if key == "appointments" and r.peek() == "[":
+            r.pos += 1
+            # writers put schema_version first; without it the records go through every migration
+            version = schema_version(data)
+            appointments, batch = [], []
+            if r.peek() == "]":
+                r.pos += 1
+            else:
+                while True:
+                    batch.append(r.value())
+                    if len(batch) >= batch_size:
+                        rejected += _validate(batch, appointments, version)
+                        batch = []
+                        report()
+                    if r.expect(",]") == "]":
+                        break
+            rejected += _validate(batch, appointments, version)
+        else:
+            data[key] = r.value()
+        report()
+        if r.expect(",}") == "}":
+            break
+    if r.peek():
+        raise ValueError(f"invalid JSON near byte {r.bytes_read}: trailing data")
+    return data, appointments, rejected
@@ -1,9 +1,10 @@
 """
 Ubagofish Scheduler — Versioned Script
-Version: 2.0
+Version: 2.1
 Changelog:
 - v1: Core scheduler with balanced-day randomizer, configurable work-rest cadence, manual-locked appointments, and Excel export.
 - v2.0: Reinforced "locked" flag for manual appointments (never overwritten), improved save/load JSON, per-day Excel export with ByBuyer/ByClient sheets and lunch slots greyed out.
+- v2.1: Scheduling logic moved to `ubagofish_engine` (importable without Streamlit); this script is the UI over it.
 
 Notes:
 - Manual (locked) appointments are preserved and never overwritten by the randomizer.
@@ -12,209 +13,227 @@ Notes:
 """
 
 import streamlit as st
-import pandas as pd
 import json
 import os
-from io import BytesIO
-from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+
+from ubagofish_audit import audit_schedule, issues_frame
+from ubagofish_bulk import import_bookings, read_bookings, report_csv
+from ubagofish_engine import DAYS, HOURS, Schedule, calendar_frame, first_slot, idx_of
+from ubagofish_events import EVENT_EXT, EventRegistry
+from ubagofish_export import export_excel
+from ubagofish_import import fingerprint, read_config
+from ubagofish_schema import NewerSchemaError
+from ubagofish_service import ChangeFeed, apply_changes
+from ubagofish_solver import repair_schedule, solve_matching
+from ubagofish_timing import PhaseTimer
 
 # -------------------------
 # App config & constants
 # -------------------------
-st.set_page_config(page_title="UbagoFish Scheduler v2.0", layout="wide")
+st.set_page_config(page_title="UbagoFish Scheduler v2.1", layout="wide")
+
+# one data file per event plus index.json; only the active event is loaded
+EVENTS_DIR = os.environ.get("UBAGOFISH_EVENTS_DIR", "ubagofish_events")
+# data file of new events: .ubs snapshot (default), .json or .sqlite/.db
+EVENT_FORMAT = os.environ.get("UBAGOFISH_EVENT_FORMAT", EVENT_EXT)
+# pre-registry single data file, imported as the first event when the registry is empty
+DATA_FILE = os.environ.get("UBAGOFISH_DATA_FILE", "ubagofish_data.ubs")
+# booking service to follow live (http://host:port or unix:/path), see ubagofish_service.py
+SERVICE_URL = os.environ.get("UBAGOFISH_SERVICE_URL")
+# one JSON line per rerun while the timing panel is on
+TIMING_LOG = os.environ.get("UBAGOFISH_TIMING_LOG", "ubagofish_timing.jsonl")
+
+# session keys that survive an event switch; everything else is per-event widget state
+SESSION_KEYS = {"registry", "timer", "show_timing", "event_choice", "feed"}
 
-DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
-HOURS = [f"{h:02d}:{m:02d}" for h in range(6, 22) for m in (0, 30)]
-DATA_FILE = "ubagofish_data.json"
+# -------------------------
+# Events
+# -------------------------
+if "registry" not in st.session_state:
+    st.session_state.registry = EventRegistry(EVENTS_DIR, ext=EVENT_FORMAT)
+registry = st.session_state.registry
+if not registry.events():
+    legacy = next((p for p in (DATA_FILE, os.path.splitext(DATA_FILE)[0] + ".json") if os.path.exists(p)), None)
+    if legacy is not None:
+        registry.import_file(legacy, os.path.splitext(os.path.basename(legacy))[0])
+    else:
+        registry.create("Evento 1")
+
+
+def switch_event(slug: str):
+    """Make `slug` this session's event; the previous one is flushed and dropped from memory."""
+    old = st.session_state.get("store")
+    if old is not None:
+        old.close()
+    for key in list(st.session_state):
+        if key not in SESSION_KEYS:
+            del st.session_state[key]
+    st.session_state.event = slug
+    st.session_state.schedule = Schedule()
+    st.session_state.store = registry.open(slug)
+    registry.set_active(slug)
+
+
+if "new_event" in st.session_state:  # created on the last rerun; select it before the widget exists
+    st.session_state.event_choice = st.session_state.pop("new_event")
+events = registry.events()
+if st.session_state.get("event_choice") not in events:
+    st.session_state.event_choice = st.session_state.get("event") if st.session_state.get("event") in events else registry.active
+if st.session_state.get("event") != st.session_state.event_choice:
+    switch_event(st.session_state.event_choice)
+if SERVICE_URL and "feed" not in st.session_state:
+    st.session_state.feed = ChangeFeed(SERVICE_URL)
+feed = st.session_state.get("feed")
 
 # -------------------------
 # Session defaults
 # -------------------------
-for key in ["clients", "buyers", "appointments"]:
-    if key not in st.session_state:
-        st.session_state[key] = []  # appointments: list of dicts {client,buyer,day,time,locked}
 if "edit_expander_open" not in st.session_state:
     st.session_state.edit_expander_open = False
-if "start_hour" not in st.session_state:
-    st.session_state.start_hour = "08:00"
-if "end_hour" not in st.session_state:
-    st.session_state.end_hour = "18:00"
-if "lunch_start" not in st.session_state:
-    st.session_state.lunch_start = "12:00"
-if "lunch_end" not in st.session_state:
-    st.session_state.lunch_end = "14:00"
-if "selected_days" not in st.session_state:
-    st.session_state.selected_days = ["Monday", "Tuesday"]
-if "time_windows" not in st.session_state:
-    st.session_state.time_windows = {}  # {buyer: {day: {start,end}}}
+if "timer" not in st.session_state:
+    st.session_state.timer = PhaseTimer()
+sched = st.session_state.schedule
+store = st.session_state.store
+timer = st.session_state.timer
+# the toggle is drawn in the sidebar later; its value from the last interaction is already here
+timer.start(st.session_state.get("show_timing", False))
 
 # -------------------------
 # Persistence helpers
 # -------------------------
 
-def load_data_from_disk():
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            return
-        st.session_state.clients = data.get("clients", st.session_state.clients)
-        st.session_state.buyers = data.get("buyers", st.session_state.buyers)
-        # normalize appointments and locked flag
-        appts_in = data.get("appointments", [])
-        appts = []
-        for a in appts_in:
-            if isinstance(a, dict):
-                locked = a.get("locked")
-                if locked is None and "manual" in a:
-                    locked = bool(a.get("manual", False))
-                appts.append({
-                    "client": a.get("client") or a.get("Client"),
-                    "buyer": a.get("buyer") or a.get("Buyer"),
-                    "day": a.get("day") or a.get("Día") or a.get("day"),
-                    "time": a.get("time") or a.get("Hora"),
-                    "locked": bool(locked)
-                })
-            else:
-                try:
-                    client, buyer, day, time = a
-                    appts.append({"client": client, "buyer": buyer, "day": day, "time": time, "locked": False})
-                except Exception:
-                    continue
-        st.session_state.appointments = appts
-        st.session_state.start_hour = data.get("start_hour", st.session_state.start_hour)
-        st.session_state.end_hour = data.get("end_hour", st.session_state.end_hour)
-        st.session_state.lunch_start = data.get("lunch_start", st.session_state.lunch_start)
-        st.session_state.lunch_end = data.get("lunch_end", st.session_state.lunch_end)
-        st.session_state.selected_days = data.get("selected_days", st.session_state.selected_days)
-        st.session_state.time_windows = data.get("time_windows", st.session_state.time_windows)
+def load_data_from_disk() -> bool:
+    """Reload when another session/process changed the file (a stat() when nothing did)."""
+    try:
+        return store.load(sched)
+    except NewerSchemaError as e:  # never autosave over a file this version cannot read
+        st.error(f"No se puede abrir {store.path}: {e}")
+        st.stop()
+    except TimeoutError:  # another process holds the file; never save what could not be loaded
+        st.warning(f"{store.path} está bloqueado por otro proceso. Vuelve a intentarlo en unos segundos.")
+        st.stop()
 
 
 def save_data_to_disk():
-    data = {
-        "clients": st.session_state.clients,
-        "buyers": st.session_state.buyers,
-        "appointments": st.session_state.appointments,
-        "start_hour": st.session_state.start_hour,
-        "end_hour": st.session_state.end_hour,
-        "lunch_start": st.session_state.lunch_start,
-        "lunch_end": st.session_state.lunch_end,
-        "selected_days": st.session_state.selected_days,
-        "time_windows": st.session_state.time_windows,
-    }
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    store.save(sched)
 
 
 def autosave():
+    """Deferred, coalesced save; a no-op when the schedule did not change."""
     try:
-        save_data_to_disk()
+        store.autosave(sched)
     except Exception:
         pass
 
-# initial load
-load_data_from_disk()
-
-# -------------------------
-# Time helpers & constraints
-# -------------------------
-
-def idx_of(t: str) -> int:
-    return HOURS.index(t)
-
-lunch_start_idx, lunch_end_idx = idx_of(st.session_state.lunch_start), idx_of(st.session_state.lunch_end)
 
-def is_in_lunch_break(t: str) -> bool:
-    return lunch_start_idx <= HOURS.index(t) < lunch_end_idx
+def run_audit():
+    """Audit the appointments as they are now; the report is shown under the calendar."""
+    with timer.span("audit"):
+        st.session_state.audit = audit_schedule(sched)
 
-# remove any appointment accidentally saved during lunch
-st.session_state.appointments = [a for a in st.session_state.appointments if not is_in_lunch_break(a["time"])]
-
-
-def is_slot_free(client: str, buyer: str, day: str, time: str) -> bool:
-    """Slot is free if no appointment exists for same day/time with either buyer or client."""
-    for a in st.session_state.appointments:
-        if a["day"] == day and a["time"] == time:
-            if a["buyer"] == buyer or a["client"] == client:
-                return False
-    return True
+# initial load
+with timer.span("load"):
+    reloaded = load_data_from_disk()
+    if feed is not None:
+        changes = feed.drain()
+        if feed.event == st.session_state.event and apply_changes(sched, changes):
+            switch_event(st.session_state.event)  # missed changes: reload the event from disk
+            st.rerun()
+    # remove any appointment accidentally saved during lunch
+    sched.drop_lunch_appointments()
+# whatever came from disk is audited, not only what the UI inserts
+if reloaded or "audit" not in st.session_state:
+    run_audit()
 
 # -------------------------
 # Sidebar: config + save/load
 # -------------------------
-with st.sidebar:
+def event_label(slug: str) -> str:
+    meta = events[slug]
+    dates = " – ".join(d for d in (meta.get("start"), meta.get("end")) if d)
+    return " · ".join(x for x in (meta["name"], dates, f"{meta.get('appointments', 0)} citas") if x)
+
+
+with st.sidebar, timer.span("sidebar"):
+    st.header("Evento")
+    st.selectbox("Evento activo", list(events), format_func=event_label, key="event_choice")
+    with st.expander("➕ Nuevo evento"):
+        new_name = st.text_input("Nombre del evento", key="new_event_name")
+        new_start = st.date_input("Desde", value=None, key="new_event_start")
+        new_end = st.date_input("Hasta", value=None, key="new_event_end")
+        if st.button("Crear evento"):
+            if not new_name.strip():
+                st.warning("Indica un nombre para el evento.")
+            else:
+                st.session_state.new_event = registry.create(
+                    new_name, new_start.isoformat() if new_start else None, new_end.isoformat() if new_end else None)
+                st.rerun()
+
     st.header("Configuration & Data")
-    buyers_input = st.text_area("Buyers (uno por línea)", ""
-".join(st.session_state.buyers), height=180)
-    st.session_state.buyers = [b.strip() for b in buyers_input.splitlines() if b.strip()]
-    clients_input = st.text_area("Clients (uno por línea)", ""
-".join(st.session_state.clients), height=180)
-    st.session_state.clients = [c.strip() for c in clients_input.splitlines() if c.strip()]
+    buyers_input = st.text_area("Buyers (uno por línea)", "\n".join(sched.buyers), height=180)
+    sched.buyers = [b.strip() for b in buyers_input.splitlines() if b.strip()]
+    clients_input = st.text_area("Clients (uno por línea)", "\n".join(sched.clients), height=180)
+    sched.clients = [c.strip() for c in clients_input.splitlines() if c.strip()]
 
     if st.button("Guardar nombres"):
         autosave(); st.success("Datos guardados en sesión y disco.")
 
     st.subheader("Días y Horario")
-    st.session_state.selected_days = st.multiselect("Días a programar", DAYS, default=st.session_state.selected_days)
-    st.session_state.start_hour = st.selectbox("Inicio del día", HOURS, index=idx_of(st.session_state.start_hour))
-    st.session_state.end_hour = st.selectbox("Fin del día", HOURS, index=idx_of(st.session_state.end_hour))
-    st.session_state.lunch_start = st.selectbox("Inicio almuerzo", HOURS, index=idx_of(st.session_state.lunch_start))
-    st.session_state.lunch_end = st.selectbox("Fin almuerzo", HOURS, index=idx_of(st.session_state.lunch_end))
+    sched.selected_days = st.multiselect("Días a programar", DAYS, default=sched.selected_days)
+    sched.start_hour = st.selectbox("Inicio del día", HOURS, index=idx_of(sched.start_hour))
+    sched.end_hour = st.selectbox("Fin del día", HOURS, index=idx_of(sched.end_hour))
+    sched.lunch_start = st.selectbox("Inicio almuerzo", HOURS, index=idx_of(sched.lunch_start))
+    sched.lunch_end = st.selectbox("Fin almuerzo", HOURS, index=idx_of(sched.lunch_end))
 
     st.divider()
     st.subheader("Save / Load Config (JSON)")
     if st.button("Save Config (JSON)"):
-        data = {
-            "clients": st.session_state.clients,
-            "buyers": st.session_state.buyers,
-            "appointments": st.session_state.appointments,
-            "start_hour": st.session_state.start_hour,
-            "end_hour": st.session_state.end_hour,
-            "lunch_start": st.session_state.lunch_start,
-            "lunch_end": st.session_state.lunch_end,
-            "selected_days": st.session_state.selected_days,
-            "time_windows": st.session_state.time_windows,
-        }
-        json_bytes = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+        json_bytes = json.dumps(sched.to_dict(), indent=2, ensure_ascii=False).encode("utf-8")
         st.download_button("Download config JSON", data=json_bytes, file_name="ubagofish_config.json", mime="application/json")
 
     uploaded = st.file_uploader("Load Config (JSON)", type=["json"])
-    if uploaded is not None:
-        try:
-            loaded = json.load(uploaded)
-            st.session_state.clients = loaded.get("clients", st.session_state.clients)
-            st.session_state.buyers = loaded.get("buyers", st.session_state.buyers)
-            st.session_state.appointments = loaded.get("appointments", st.session_state.appointments)
-            st.session_state.start_hour = loaded.get("start_hour", st.session_state.start_hour)
-            st.session_state.end_hour = loaded.get("end_hour", st.session_state.end_hour)
-            st.session_state.lunch_start = loaded.get("lunch_start", st.session_state.lunch_start)
-            st.session_state.lunch_end = loaded.get("lunch_end", st.session_state.lunch_end)
-            st.session_state.selected_days = loaded.get("selected_days", st.session_state.selected_days)
-            st.session_state.time_windows = loaded.get("time_windows", st.session_state.time_windows)
-            autosave(); st.success("Configuración cargada desde JSON.")
-        except Exception as e:
-            st.error(f"Error cargando JSON: {e}")
+    # each upload is applied once, not on every rerun while it sits in the uploader
+    if uploaded is not None and uploaded.file_id != st.session_state.get("import_file_id"):
+        st.session_state.import_file_id = uploaded.file_id
+        digest = fingerprint(uploaded.getbuffer())
+        if st.session_state.get("import_applied") == (digest, sched.version):
+            st.info("Esta configuración ya está aplicada.")
+        else:
+            bar = st.progress(0.0, text="Importando configuración…")
+            try:
+                data, appts, rejected = read_config(uploaded, uploaded.size,
+                                                    progress=lambda f: bar.progress(f, text="Importando configuración…"))
+                data.pop("appointments", None)  # present only when it was not a list
+                sched.update_from_dict(data)
+                if appts is not None:
+                    sched.set_appointments(appts)
+                st.session_state.import_applied = (digest, sched.version)
+                autosave(); run_audit(); st.success("Configuración cargada desde JSON.")
+                if rejected:
+                    st.warning(f"{rejected} citas inválidas omitidas.")
+            except Exception as e:
+                st.error(f"Error cargando JSON: {e}")
+            finally:
+                bar.empty()
 
     st.divider()
     with st.expander("🗑️ Editar / Borrar Citas"):
         if st.button("Borrar TODAS las citas"):
-            st.session_state.appointments.clear(); autosave(); st.warning("Todas las citas fueron eliminadas.")
-        buyer_clear = st.selectbox("Borrar citas de Buyer", [""] + st.session_state.buyers, key="clear_buyer")
+            sched.set_appointments([]); autosave(); st.warning("Todas las citas fueron eliminadas.")
+        buyer_clear = st.selectbox("Borrar citas de Buyer", [""] + sched.buyers, key="clear_buyer")
         if st.button("Borrar citas del Buyer seleccionado") and buyer_clear:
-            st.session_state.appointments = [a for a in st.session_state.appointments if a["buyer"] != buyer_clear]
+            sched.remove_appointments(lambda a: a["buyer"] == buyer_clear)
             autosave(); st.warning(f"Citas de {buyer_clear} eliminadas.")
-        client_clear = st.selectbox("Borrar citas de Client", [""] + st.session_state.clients, key="clear_client")
+        client_clear = st.selectbox("Borrar citas de Client", [""] + sched.clients, key="clear_client")
         if st.button("Borrar citas del Client seleccionado") and client_clear:
-            st.session_state.appointments = [a for a in st.session_state.appointments if a["client"] != client_clear]
+            sched.remove_appointments(lambda a: a["client"] == client_clear)
             autosave(); st.warning(f"Citas de {client_clear} eliminadas.")
 
 # -------------------------
 # Tabs (Randomize / Manual)
 # -------------------------
 
-tab_random, tab_manual = st.tabs(["🎲 Generador Aleatorio", "✏️ Agendar Manualmente"]) 
+tab_random, tab_manual = st.tabs(["🎲 Generador Aleatorio", "✏️ Agendar Manualmente"])
 
 # -------------------------
 # Randomizer with heuristics
@@ -227,36 +246,26 @@ with tab_random:
         if "buyers_random" not in st.session_state:
             st.session_state.buyers_random = [""]
         for i,_ in enumerate(st.session_state.buyers_random):
-            buyer = st.selectbox(f"Buyer {i+1}", st.session_state.buyers, key=f"buyer_random_{i}")
+            buyer = st.selectbox(f"Buyer {i+1}", sched.buyers, key=f"buyer_random_{i}")
             if buyer:
                 selected_buyers.append(buyer)
         if st.button("Agregar otro Buyer"):
             st.session_state.buyers_random.append("")
     with col2:
-        selected_clients = st.multiselect("Seleccionar Clients", st.session_state.clients)
+        selected_clients = st.multiselect("Seleccionar Clients", sched.clients)
 
     st.markdown("### Ventanas Horarias por Buyer (opcional)")
-    for buyer in selected_buyers:
-        st.markdown(f"**{buyer}**")
-        st.session_state.time_windows.setdefault(buyer, {})
-        for day in st.session_state.selected_days:
-            col_from, col_to = st.columns(2)
-            with col_from:
-                start = st.selectbox(
-                    f"{day} desde",
-                    HOURS,
-                    key=f"{buyer}_{day}_start",
-                    index=idx_of(st.session_state.time_windows.get(buyer, {}).get(day, {}).get("start", st.session_state.start_hour)),
-                )
-            with col_to:
-                end = st.selectbox(
-                    f"{day} hasta",
-                    HOURS,
-                    key=f"{buyer}_{day}_end",
-                    index=idx_of(st.session_state.time_windows.get(buyer, {}).get(day, {}).get("end", st.session_state.end_hour)),
-                )
-            st.session_state.time_windows[buyer][day] = {"start": start, "end": end}
-    autosave()
+    with timer.span("time_windows"):
+        for buyer in selected_buyers:
+            st.markdown(f"**{buyer}**")
+            for day in sched.selected_days:
+                win_start, win_end = sched.window_for(buyer, day)
+                col_from, col_to = st.columns(2)
+                with col_from:
+                    start = st.selectbox(f"{day} desde", HOURS, key=f"{buyer}_{day}_start", index=idx_of(win_start))
+                with col_to:
+                    end = st.selectbox(f"{day} hasta", HOURS, key=f"{buyer}_{day}_end", index=idx_of(win_end))
+                sched.set_time_window(buyer, day, start, end)
 
     st.divider()
     colA, colB, colC = st.columns([1,1,1])
@@ -267,239 +276,204 @@ with tab_random:
     with colC:
         rest_slots = st.number_input("Duración del descanso (slots)", min_value=1, max_value=3, value=1, step=1, key="rest_slots")
 
-    def gen_slots_for(buyer: str, day: str) -> list[str]:
-        """Return ordered list of time strings honoring buyer's day window, global window, lunch and interval."""
-        start = st.session_state.time_windows.get(buyer, {}).get(day, {}).get("start", st.session_state.start_hour)
-        end = st.session_state.time_windows.get(buyer, {}).get(day, {}).get("end", st.session_state.end_hour)
-        start_idx = max(idx_of(start), idx_of(st.session_state.start_hour))
-        end_idx = min(idx_of(end), idx_of(st.session_state.end_hour))
-        step = interval // 30
-        slots = []
-        for i in range(start_idx, end_idx):
-            if i % step != 0:
-                continue
-            t = HOURS[i]
-            if not is_in_lunch_break(t):
-                slots.append(t)
-        return slots
-
-    def remove_unlocked_appointments_for(buyers: list[str]):
-        """Remove only unlocked (non-locked) appointments that involve selected buyers across all days."""
-        st.session_state.appointments = [a for a in st.session_state.appointments if (a["buyer"] not in buyers) or a.get("locked", False)]
-
-    def balanced_bucket(count: int, days: list[str]) -> dict:
-        """Return {day: n} appts distributed as evenly as possible."""
-        if not days:
-            return {}
-        q, r = divmod(count, len(days))
-        alloc = {d: q for d in days}
-        for i in range(r):
-            alloc[days[i % len(days)]] += 1
-        return alloc
-
-    def place_for_day(buyer: str, day: str, clients_for_day: list[str]):
-        """Place clients on that day respecting rest cadence and existing locked blocks."""
-        # Map of occupied times for that day (including locked and those placed earlier in this run)
-        taken = {a["time"]: a for a in st.session_state.appointments if a["day"] == day}
-        slots = gen_slots_for(buyer, day)
-        placed = 0
-        cadence_count = 0
-        i = 0
-        ci = 0
-        while i < len(slots) and ci < len(clients_for_day):
-            t = slots[i]
-            # Enforce cadence: after appts_before_rest, skip rest_slots slots
-            if cadence_count >= appts_before_rest:
-                i += rest_slots
-                cadence_count = 0
-                continue
-
-            # Slot availability: slot must be free and no conflicts for client/buyer and not occupied by locked
-            if t not in taken and is_slot_free(clients_for_day[ci], buyer, day, t):
-                st.session_state.appointments.append({
-                    "client": clients_for_day[ci],
-                    "buyer": buyer,
-                    "day": day,
-                    "time": t,
-                    "locked": False,
-                })
-                taken[t] = True
-                placed += 1
-                cadence_count += 1
-                ci += 1
-                i += 1
-            else:
-                i += 1
-        return placed
-
-    if st.button("Generar citas aleatorias"):
-        # remove previous unlocked appointments for the selected buyers so we can reflow
-        remove_unlocked_appointments_for(selected_buyers)
-        days_pool = st.session_state.selected_days[:]
-        for buyer in selected_buyers:
-            total = len(selected_clients)
-            if total == 0:
-                continue
-            alloc = balanced_bucket(total, days_pool)
-            # Distribute specific clients into day buckets in round-robin fashion
-            day_lists = {d: [] for d in days_pool}
-            day_cycle = [d for d, n in alloc.items() for _ in range(n)]
-            for idx, client in enumerate(selected_clients):
-                if idx < len(day_cycle):
-                    day_lists[day_cycle[idx]].append(client)
-                else:
-                    # fallback: append to first day
-                    day_lists[days_pool[0]].append(client)
-            for d in days_pool:
-                if day_lists[d]:
-                    place_for_day(buyer, d, day_lists[d])
-        autosave(); st.success("Citas generadas y reacomodadas (locked respetadas, días balanceados, descansos aplicados).")
+    col_gen, col_opt, col_fill = st.columns([1,1,1])
+    with col_gen:
+        if st.button("Generar citas aleatorias"):
+            with timer.span("randomize"):
+                sched.randomize(selected_buyers, selected_clients, interval, appts_before_rest, rest_slots)
+            autosave(); st.success("Citas generadas y reacomodadas (locked respetadas, días balanceados, descansos aplicados).")
+    with col_opt:
+        if st.button("Generar citas (asignación óptima)"):
+            with timer.span("matching"):
+                placed = solve_matching(sched, selected_buyers, selected_clients, interval, appts_before_rest, rest_slots)
+            autosave(); st.success(f"{placed} citas asignadas por emparejamiento máximo (locked respetadas).")
+    with col_fill:
+        if st.button("Completar sin reorganizar", help="Solo agenda los pares buyer–client seleccionados que aún no tienen cita, en huecos libres; "
+                     "mueve como mucho una cita no bloqueada por par. Selecciona los buyers/clients nuevos."):
+            with timer.span("repair"):
+                repaired = repair_schedule(sched, selected_buyers, selected_clients, interval, appts_before_rest, rest_slots)
+            autosave(); st.success(f"{repaired['placed']} citas nuevas en huecos libres, {repaired['moved']} citas movidas.")
+            if repaired["unplaced"]:
+                st.warning(f"{len(repaired['unplaced'])} pares sin hueco: " + ", ".join(f"{b}–{c}" for b, c in repaired["unplaced"][:20])
+                           + ("…" if len(repaired["unplaced"]) > 20 else ""))
 
 # -------------------------
 # Manual scheduling (locked)
 # -------------------------
 with tab_manual:
     st.subheader("✏️ Agendar Manualmente (bloquea el horario)")
-    if not st.session_state.buyers or not st.session_state.clients:
+    if not sched.buyers or not sched.clients:
         st.info("Añade buyers y clients en la barra lateral antes de crear citas manuales.")
     else:
-        buyer_manual = st.selectbox("Buyer", st.session_state.buyers, key="buyer_manual")
-        client_manual = st.selectbox("Client", st.session_state.clients, key="client_manual")
-        dia_manual = st.selectbox("Día", st.session_state.selected_days, key="dia_manual")
-        valid_times = [h for h in HOURS if idx_of(st.session_state.start_hour) <= idx_of(h) < idx_of(st.session_state.end_hour)]
+        buyer_manual = st.selectbox("Buyer", sched.buyers, key="buyer_manual")
+        client_manual = st.selectbox("Client", sched.clients, key="client_manual")
+        dia_manual = st.selectbox("Día", sched.selected_days, key="dia_manual")
+        valid_times = [HOURS[i] for i in sched.day_slots()]
         hora_manual = st.selectbox("Hora", valid_times, key="hora_manual")
         if st.button("Agendar cita manual"):
-            if is_in_lunch_break(hora_manual):
+            if sched.is_in_lunch_break(hora_manual):
                 st.warning("No se pueden agendar durante el almuerzo.")
-            elif not is_slot_free(client_manual, buyer_manual, dia_manual, hora_manual):
-                st.warning("El Buyer o Client ya tiene cita a esa hora.")
+            elif not sched.is_slot_free(client_manual, buyer_manual, dia_manual, hora_manual):
+                free = sched.common_free_mask(client_manual, buyer_manual, dia_manual)
+                hint = f" Primer horario libre para ambos: {HOURS[first_slot(free)]}." if free else ""
+                st.warning("El Buyer o Client ya tiene cita a esa hora." + hint)
             else:
                 appt = {"client": client_manual, "buyer": buyer_manual, "day": dia_manual, "time": hora_manual, "locked": True}
-                exists = any(a for a in st.session_state.appointments if a["client"]==client_manual and a["buyer"]==buyer_manual and a["day"]==dia_manual and a["time"]==hora_manual)
-                if exists:
-                    st.warning("Esta cita ya está agendada.")
-                else:
-                    st.session_state.appointments.append(appt); autosave(); st.success("Cita manual agendada y bloqueada.")
+                sched.add_appointment(appt); autosave(); st.success("Cita manual agendada y bloqueada.")
+
+    st.markdown("### Importar citas bloqueadas (CSV / XLSX)")
+    st.caption("Columnas: client, buyer, day, time (o Cliente, Comprador, Día, Hora). Las filas válidas se agendan bloqueadas de una vez; las demás van al informe de conflictos.")
+    bulk = st.file_uploader("Citas pactadas", type=["csv", "xlsx"], key="bulk_upload")
+    # applied once per upload, like the config file
+    if bulk is not None and bulk.file_id != st.session_state.get("bulk_file_id"):
+        st.session_state.bulk_file_id = bulk.file_id
+        try:
+            with timer.span("bulk_import"):
+                ids, report = import_bookings(sched, read_bookings(bulk.getvalue(), bulk.name))
+        except Exception as e:
+            st.session_state.bulk_result = None
+            st.error(f"No se pudo leer el archivo: {e}")
+        else:
+            if ids:
+                autosave(); run_audit()
+            st.session_state.bulk_result = (bulk.name, len(ids), len(report), report_csv(report) if len(report) else None)
+    if st.session_state.get("bulk_result"):
+        name, booked, conflicts, report_bytes = st.session_state.bulk_result
+        st.success(f"{name}: {booked} citas agendadas y bloqueadas.")
+        if conflicts:
+            st.warning(f"{conflicts} filas con conflictos no se agendaron.")
+            st.download_button("Descargar informe de conflictos (CSV)", data=report_bytes,
+                               file_name=f"conflictos_{os.path.splitext(name)[0]}.csv", mime="text/csv")
 
 # -------------------------
 # Calendar view
 # -------------------------
 st.subheader("📅 Calendario de Citas")
-if st.session_state.appointments:
-    data = []
-    for day in DAYS:
-        row = {"Hora": day}
-        appts_day = [a for a in st.session_state.appointments if a["day"] == day]
-        for time in HOURS[idx_of(st.session_state.start_hour):idx_of(st.session_state.end_hour)]:
-            if is_in_lunch_break(time):
-                row[time] = "LUNCH BREAK"
-            else:
-                labels = []
-                for a in appts_day:
-                    if a["time"] == time:
-                        label = f"{a['buyer']} - {a['client']}" + (" 🔒" if a.get("locked") else "")
-                        labels.append(label)
-                row[time] = "; ".join(labels)
-        data.append(row)
-    df = pd.DataFrame(data).set_index("Hora").T
-    st.dataframe(df, use_container_width=True)
-else:
-    st.info("No hay citas programadas aún.")
+with timer.span("calendar"):
+    if sched.appointments:
+        st.dataframe(calendar_frame(sched), use_container_width=True)
+    else:
+        st.info("No hay citas programadas aún.")
+
+# -------------------------
+# Audit: double bookings, duplicates, lunch/window violations
+# -------------------------
+audit = st.session_state.audit
+with st.expander(f"🩺 Auditoría de citas ({len(audit['issues'])} problemas)", expanded=bool(audit["issues"])):
+    if st.button("Auditar ahora"):
+        run_audit()
+        audit = st.session_state.audit
+    labels = {"buyer_double_booking": "Buyer doble", "client_double_booking": "Client doble", "duplicate": "Duplicadas",
+              "lunch": "En almuerzo", "outside_day": "Fuera del día", "unscheduled_day": "Día no programado",
+              "outside_window": "Fuera de ventana"}
+    cols = st.columns(len(labels))
+    for col, (kind, label) in zip(cols, labels.items()):
+        col.metric(label, audit["counts"][kind])
+    if audit["issues"]:
+        issues = issues_frame(audit)
+        st.dataframe(issues, use_container_width=True, hide_index=True)
+        st.download_button("Descargar auditoría (CSV)", data=issues.to_csv(index=False).encode("utf-8-sig"),
+                           file_name="auditoria_citas.csv", mime="text/csv")
+    else:
+        st.caption(f"{audit['appointments']} citas revisadas sin problemas.")
 
 # -------------------------
 # Export to Excel (two sheets per day: ByBuyer, ByClient)
 # -------------------------
 if st.button("📤 Export Schedule (Excel)"):
-    times = HOURS[idx_of(st.session_state.start_hour):idx_of(st.session_state.end_hour)]
-    buyers = st.session_state.buyers[:]
-    clients = st.session_state.clients[:]
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        for day in st.session_state.selected_days:
-            # buyer view
-            df_b = pd.DataFrame(index=times, columns=buyers)
-            for t in times:
-                for b in buyers:
-                    df_b.at[t, b] = "LUNCH BREAK" if is_in_lunch_break(t) else ""
-            # client view
-            df_c = pd.DataFrame(index=times, columns=clients)
-            for t in times:
-                for c in clients:
-                    df_c.at[t, c] = "LUNCH BREAK" if is_in_lunch_break(t) else ""
-            # fill day's appointments
-            for a in [x for x in st.session_state.appointments if x["day"] == day]:
-                t = a["time"]
-                b = a["buyer"]
-                c = a["client"]
-                client_marker = f"{c}{'*' if a.get('locked') else ''}"
-                buyer_marker = f"{b}{'*' if a.get('locked') else ''}"
-                if b in buyers:
-                    df_b.at[t, b] = client_marker
-                if c in clients:
-                    df_c.at[t, c] = buyer_marker
-
-            df_b_reset = df_b.reset_index().rename(columns={"index": "Time"})
-            df_c_reset = df_c.reset_index().rename(columns={"index": "Time"})
-            df_b_reset.to_excel(writer, sheet_name=f"ByBuyer_{day}", index=False)
-            df_c_reset.to_excel(writer, sheet_name=f"ByClient_{day}", index=False)
-
-        # summary sheets
-        df_all = pd.DataFrame(st.session_state.appointments)
-        if not df_all.empty:
-            df_all = df_all.rename(columns={"client": "Client", "buyer": "Buyer", "day": "Día", "time": "Hora", "locked": "Locked"})
-            df_all["Count"] = 1
-            df_all.groupby("Client")["Count"].sum().reset_index().to_excel(writer, sheet_name="Summary_Clients", index=False)
-            df_all.groupby("Buyer")["Count"].sum().reset_index().to_excel(writer, sheet_name="Summary_Buyers", index=False)
-
-    # style the workbook (headers & lunch grey)
-    output.seek(0)
-    wb = load_workbook(output)
-    header_fill = PatternFill("solid", fgColor="305496")
-    header_font = Font(color="FFFFFF", bold=True, name="Calibri", size=11)
-    lunch_fill = PatternFill("solid", fgColor="D9D9D9")
-    border = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
-
-    for ws in wb.worksheets:
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, max_col=ws.max_column):
-            for cell in row:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                cell.border = border
-                if cell.value == "LUNCH BREAK":
-                    cell.fill = lunch_fill
-    final = BytesIO(); wb.save(final); final.seek(0)
+    with timer.span("export"):
+        final = export_excel(sched)
     st.download_button("Download Schedule Excel", data=final, file_name="UbagoFish_Schedule_v2.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 # -------------------------
 # In-place editor for existing appts
 # -------------------------
-with st.expander("🔧 Editar Citas", expanded=st.session_state.edit_expander_open):
+EDIT_PAGE_SIZE = 50
+
+
+def appointment_label(aid: int) -> str:
+    a = sched.by_id[aid]
+    return f"#{aid} {a['client']} con {a['buyer']} ({a['day']} {a['time']})" + (" [locked]" if a.get("locked") else "")
+
+
+with st.expander("🔧 Editar Citas", expanded=st.session_state.edit_expander_open), timer.span("editor"):
     st.session_state.edit_expander_open = True
-    if st.session_state.appointments:
-        options = [
-            f"{a['client']} con {a['buyer']} ({a['day']} {a['time']})" + (" [locked]" if a.get("locked") else "")
-            for a in st.session_state.appointments
-        ]
-        sel = st.selectbox("Seleccionar cita para editar", options)
-        if sel:
-            idx = options.index(sel)
-            a = st.session_state.appointments[idx]
-            new_b = st.selectbox("Nuevo Buyer", st.session_state.buyers, index=st.session_state.buyers.index(a["buyer"]))
-            new_c = st.selectbox("Nuevo Client", st.session_state.clients, index=st.session_state.clients.index(a["client"]))
-            new_d = st.selectbox("Nuevo Día", st.session_state.selected_days, index=st.session_state.selected_days.index(a["day"]))
-            new_h = st.selectbox("Nueva Hora", HOURS, index=HOURS.index(a["time"]))
+    if sched.appointments:
+        col_fb, col_fc, col_fd, col_ft = st.columns(4)
+        with col_fb:
+            f_buyer = st.selectbox("Filtrar Buyer", [""] + sched.buyers, key="edit_f_buyer")
+        with col_fc:
+            f_client = st.selectbox("Filtrar Client", [""] + sched.clients, key="edit_f_client")
+        with col_fd:
+            f_day = st.selectbox("Filtrar Día", [""] + sched.selected_days, key="edit_f_day")
+        with col_ft:
+            f_time = st.selectbox("Filtrar Hora", [""] + HOURS, key="edit_f_time")
+        found = sched.find_appointments(f_buyer, f_client, f_day, f_time)
+        pages = max(1, -(-len(found) // EDIT_PAGE_SIZE))
+        filters = (f_buyer, f_client, f_day, f_time)
+        if st.session_state.get("edit_filters") != filters or st.session_state.get("edit_page", 1) > pages:
+            st.session_state.edit_filters = filters
+            st.session_state.edit_page = 1
+        page = st.number_input("Página", min_value=1, max_value=pages, step=1, key="edit_page")
+        # only the visible page is formatted and sent to the browser
+        page_ids = found[(page - 1) * EDIT_PAGE_SIZE:page * EDIT_PAGE_SIZE]
+        st.caption(f"{len(found)} citas encontradas · página {page} de {pages}.")
+        aid = st.selectbox("Seleccionar cita para editar", page_ids, format_func=appointment_label, key="edit_sel")
+        if aid is not None and aid in sched.by_id:
+            a = sched.by_id[aid]
+            new_b = st.selectbox("Nuevo Buyer", sched.buyers, index=sched.buyers.index(a["buyer"]))
+            new_c = st.selectbox("Nuevo Client", sched.clients, index=sched.clients.index(a["client"]))
+            new_d = st.selectbox("Nuevo Día", sched.selected_days, index=sched.selected_days.index(a["day"]))
+            new_h = st.selectbox("Nueva Hora", HOURS, index=idx_of(a["time"]))
             new_locked = st.checkbox("Marcar como locked (bloqueado)", value=a.get("locked", False))
             if st.button("Guardar cambios"):
-                if is_in_lunch_break(new_h):
+                if sched.is_in_lunch_break(new_h):
                     st.warning("No se pueden agendar durante el almuerzo.")
-                elif not (a["day"] == new_d and a["time"] == new_h and a["buyer"] == new_b and a["client"] == new_c) and not is_slot_free(new_c, new_b, new_d, new_h):
+                elif not (a["day"] == new_d and a["time"] == new_h and a["buyer"] == new_b and a["client"] == new_c) and not sched.is_slot_free(new_c, new_b, new_d, new_h):
                     st.warning("El Buyer o Client ya tiene cita a esa hora.")
                 else:
-                    st.session_state.appointments[idx] = {"client": new_c, "buyer": new_b, "day": new_d, "time": new_h, "locked": new_locked}
+                    sched.update_appointment(aid, {"client": new_c, "buyer": new_b, "day": new_d, "time": new_h, "locked": new_locked})
                     autosave(); st.success("Cita editada.")
+        elif not found:
+            st.info("Ninguna cita coincide con los filtros.")
     else:
         st.info("No hay citas para editar.")
+
+# persist whatever changed during this rerun (no-op when nothing did)
+with timer.span("autosave"):
+    autosave()
+    try:
+        registry.sync(st.session_state.event, sched)
+    except OSError:  # counts in the event list catch up on a later rerun
+        pass
+
+# -------------------------
+# Live bookings from the booking service
+# -------------------------
+if feed is not None:
+    @st.fragment(run_every=2)
+    def booking_feed_status():
+        if feed.pending():
+            st.rerun()  # whole app: the next run applies the queued bookings
+        if not feed.connected:
+            st.caption("🔴 Servicio de reservas no disponible")
+        elif feed.event != st.session_state.event:
+            st.caption(f"🟡 El servicio de reservas trabaja en otro evento ({feed.event})")
+        else:
+            st.caption("🟢 Reservas en vivo")
+
+    with st.sidebar:
+        booking_feed_status()
+
+# -------------------------
+# Debug: per-phase timings
+# -------------------------
+timer.finish(TIMING_LOG)
+with st.sidebar:
+    st.divider()
+    if st.toggle("⏱️ Tiempos por fase (debug)", key="show_timing"):
+        if timer.history:
+            st.dataframe(timer.stats(), hide_index=True, use_container_width=True)
+            st.caption(f"p50/p95 sobre las últimas {timer.window} ejecuciones · registro en {TIMING_LOG}")
+        else:
+            st.caption("Los tiempos aparecen a partir de la siguiente ejecución.")
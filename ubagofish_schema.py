@@ -0,0 +1,106 @@
+"""
+Ubagofish Scheduler — data file schema
+`schema_version` of the serialized event and the migrations that bring older documents up to
+it. Documents without the field are version 0, which covers every historical app:
+- v12: `proveedores` / `empresas` lists and (proveedor, empresa, day, time) tuples,
+- darklight / v14: `clients` / `buyers` with (client, buyer, day, time) tuples,
+- early v15: dict appointments with `Client`/`Buyer`/`Día`/`Hora` keys and a `manual` flag.
+
+Notes:
+- Each migration has a document step (top-level keys) and an appointment step (one record);
+  the appointment steps are composed so a document, or a stream of appointment batches, is
+  upgraded in a single pass.
+- Current-version documents are used as they are: no per-record fallback logic on the hot path.
+- This module imports nothing from the app, so the engine and the readers can both use it.
+"""
+
+SCHEMA_VERSION = 1
+
+
+class NewerSchemaError(ValueError):
+    """The data was written by a newer version of the app; refuse it rather than overwrite it."""
+
+
+def _v0_document(data: dict) -> dict:
+    # v12 positions match (client, buyer, day, time): proveedores -> clients, empresas -> buyers
+    if "clients" not in data and "proveedores" in data:
+        data["clients"] = data.pop("proveedores")
+    if "buyers" not in data and "empresas" in data:
+        data["buyers"] = data.pop("empresas")
+    return data
+
+
+def _v0_appointment(a):
+    if isinstance(a, dict):
+        locked = a.get("locked")
+        if locked is None and "manual" in a:
+            locked = bool(a.get("manual", False))
+        return {
+            "client": a.get("client") or a.get("Client"),
+            "buyer": a.get("buyer") or a.get("Buyer"),
+            "day": a.get("day") or a.get("Día"),
+            "time": a.get("time") or a.get("Hora"),
+            "locked": bool(locked),
+        }
+    try:
+        client, buyer, day, time = a
+    except (TypeError, ValueError):
+        return None
+    return {"client": client, "buyer": buyer, "day": day, "time": time, "locked": False}
+
+
+# version -> (document step, appointment step), each producing version + 1;
+# an appointment step returns None for records that cannot be read
+MIGRATIONS = {
+    0: (_v0_document, _v0_appointment),
+}
+
+
+def schema_version(data: dict) -> int:
+    """Schema version of a serialized document; NewerSchemaError if it is newer than this code."""
+    version = data.get("schema_version", 0)
+    if not isinstance(version, int) or version < 0:
+        raise ValueError(f"invalid schema_version {version!r}")
+    if version > SCHEMA_VERSION:
+        raise NewerSchemaError(f"data file schema {version} is newer than this version supports ({SCHEMA_VERSION})")
+    return version
+
+
+def appointment_upgrader(version: int):
+    """One function taking an appointment record from `version` to the current schema (None when current)."""
+    steps = [MIGRATIONS[v][1] for v in range(version, SCHEMA_VERSION)]
+    if not steps:
+        return None
+    if len(steps) == 1:
+        return steps[0]
+
+    def upgrade_record(a):
+        for step in steps:
+            a = step(a)
+            if a is None:
+                return None
+        return a
+
+    return upgrade_record
+
+
+def upgrade_appointments(appointments, version: int) -> list:
+    """`appointments` (any iterable) upgraded from `version`, unreadable records dropped."""
+    upgrade_record = appointment_upgrader(version)
+    if upgrade_record is None:
+        return appointments if isinstance(appointments, list) else list(appointments)
+    return [r for r in map(upgrade_record, appointments) if r is not None]
+
+
+def upgrade(data: dict) -> dict:
+    """`data` in the current schema (the same object when it already is, else a migrated copy)."""
+    version = schema_version(data)
+    if version == SCHEMA_VERSION:
+        return data
+    data = dict(data)
+    for v in range(version, SCHEMA_VERSION):
+        data = MIGRATIONS[v][0](data)
+    if "appointments" in data:
+        data["appointments"] = upgrade_appointments(data["appointments"] or [], version)
+    data["schema_version"] = SCHEMA_VERSION
+    return data
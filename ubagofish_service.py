@@ -0,0 +1,542 @@
+"""
+Ubagofish Scheduler — booking service
+Local asyncio HTTP service (TCP or Unix socket) that books appointments into one event while
+the fair runs, so buyers' assistants can submit bookings programmatically. Bookings follow
+the app's manual-booking rules (known buyer and client, a selected day, inside the day, not at
+lunch, both free) and are stored locked, so the randomizer never moves them.
+
+Endpoints (JSON in and out):
+  GET    /health                       {"event", "version", "appointments", "seq"}
+  GET    /slots?day=Monday&time=09:00  appointments in that slot and the slot's version
+  POST   /bookings                     {"client", "buyer", "day", "time", "expected_version"?}
+  DELETE /bookings/<id>?expected_version=N
+  GET    /changes[?since=<seq>]        text/event-stream of committed bookings/cancellations
+
+Notes:
+- Every (day, slot) has its own asyncio lock and version. A booking holds only its slot's
+  lock from the free-check until its change is on disk, so attempts on the same slot are
+  serialized while different slots proceed concurrently; `/slots` takes the same lock and
+  never shows a booking that could still be rolled back.
+- Writes are group commits: bookings arriving within `commit_delay` share one snapshot write,
+  done on a worker thread. A failed write rolls the affected bookings back (503); a cancellation
+  rolled back keeps its ID.
+- `expected_version` makes a request optimistic: a client that read the slot at version N gets
+  409 "stale" if anything changed in that slot since, instead of acting on outdated data.
+  Versions are global change sequence numbers, so they only ever increase.
+- While idle the service reloads the event file when another process (the app) changed it.
+  The file is read on a worker thread and applied on the loop, adding and removing only the
+  appointments that differ, so the ones it already has keep their IDs and a booking can
+  still be cancelled by the ID it was confirmed with. File writes on both sides are
+  compare-and-swap merges (see `ubagofish_storage`), so a session saving an older copy of the
+  event does not drop the service's bookings. SQLite writes also run on a worker thread.
+- Changes carry appointment dicts (IDs are per process). A new subscriber starts at the
+  current change; the last BACKLOG changes are kept so a reconnecting one resumes from its
+  `since`, and one that is too far behind gets a "reset" event and should reload the event.
+- `ChangeFeed` is the blocking subscriber used by Streamlit sessions: a daemon thread reads the
+  stream and queues changes until the next rerun applies them with `apply_changes()`.
+"""
+
+import argparse
+import asyncio
+from collections import deque
+import http.client
+import json
+import queue
+import socket
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from ubagofish_engine import HOURS, SLOT_OF, Schedule, first_slot
+from ubagofish_storage import FileStore
+
+BACKLOG = 10_000  # committed changes kept for subscribers that reconnect
+SUBSCRIBER_QUEUE = 1_000  # changes buffered per subscriber before it is dropped
+MAX_BODY = 1 << 16
+HEARTBEAT = 15.0  # seconds between keep-alive comments on idle change streams
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 422: "Unprocessable Entity", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, error: str, **extra):
+        super().__init__(error)
+        self.status = status
+        self.payload = {"error": error, **extra}
+
+
+class SlotLocks:
+    """One asyncio.Lock per (day, slot), created on first use."""
+
+    def __init__(self):
+        self._locks = {}
+
+    def __call__(self, key: tuple) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+
+class BookingService:
+    """Books into `sched` and persists it through `store`; run it with `serve()`."""
+
+    def __init__(self, sched: Schedule, store, event: str = None, commit_delay: float = 0.002,
+                 reload_interval: float = 1.0):
+        self.sched = sched
+        self.store = store
+        self.event = event
+        self.commit_delay = commit_delay
+        self.reload_interval = reload_interval
+        self.locks = SlotLocks()
+        self.seq = 0  # last committed change
+        self._slot_versions = {}  # (day, slot) -> seq of the last change there
+        self._floor = 0  # version of every slot after a reload from disk
+        self._backlog = deque(maxlen=BACKLOG)
+        self._subscribers = set()
+        self._saved_version = sched.version
+        self._save_task = None
+
+    # -------------------------
+    # Booking rules
+    # -------------------------
+
+    def slot_version(self, key: tuple) -> int:
+        return max(self._slot_versions.get(key, 0), self._floor)
+
+    def _slot_key(self, day, time) -> tuple:
+        if day not in self.sched.selected_days:
+            raise HttpError(422, "day is not scheduled", day=day)
+        if time not in SLOT_OF or SLOT_OF[time] not in self.sched.day_slots():
+            raise HttpError(422, "time is outside the day", time=time)
+        return day, SLOT_OF[time]
+
+    def _check_expected(self, key: tuple, expected):
+        if expected is not None and _int(expected, "expected_version") != self.slot_version(key):
+            raise HttpError(409, "stale", slot_version=self.slot_version(key))
+
+    async def book(self, req: dict) -> dict:
+        client, buyer, day, time = (_str(req.get(k), k) for k in ("client", "buyer", "day", "time"))
+        if buyer not in self.sched.buyers or client not in self.sched.clients:
+            raise HttpError(422, "unknown buyer or client")
+        key = self._slot_key(day, time)
+        if self.sched.is_in_lunch_break(time):
+            raise HttpError(422, "lunch break")
+        async with self.locks(key):
+            self._check_expected(key, req.get("expected_version"))
+            if not self.sched.is_slot_free(client, buyer, day, time):
+                free = self.sched.common_free_mask(client, buyer, day)
+                raise HttpError(409, "conflict", slot_version=self.slot_version(key),
+                                first_free=HOURS[first_slot(free)] if free else None)
+            a = {"client": client, "buyer": buyer, "day": day, "time": time, "locked": True}
+            aid = self.sched.add_appointment(a)
+            try:
+                await self._commit()
+            except Exception:
+                self.sched.remove_appointment(aid)
+                raise HttpError(503, "could not save the booking")
+            seq = self._publish(key, "book", a)
+        return {"id": aid, "appointment": a, "slot_version": seq, "seq": seq}
+
+    async def cancel(self, aid: int, expected=None) -> dict:
+        a = self.sched.by_id.get(aid)
+        if a is None:
+            raise HttpError(404, "no such appointment", id=aid)
+        key = (a["day"], SLOT_OF[a["time"]])
+        async with self.locks(key):
+            if aid not in self.sched.by_id:  # cancelled while we waited for the lock
+                raise HttpError(404, "no such appointment", id=aid)
+            self._check_expected(key, expected)
+            self.sched.remove_appointment(aid)
+            try:
+                await self._commit()
+            except Exception:
+                self.sched.restore_appointment(aid, a)  # same ID: subscribers may already know it
+                raise HttpError(503, "could not save the cancellation")
+            seq = self._publish(key, "cancel", a)
+        return {"id": aid, "appointment": a, "slot_version": seq, "seq": seq}
+
+    async def slot(self, day, time) -> dict:
+        day, time = _str(day, "day"), _str(time, "time")
+        key = self._slot_key(day, time)
+        async with self.locks(key):
+            ids = self.sched.find_appointments(day=day, time=time)
+            by_id = self.sched.by_id
+            return {"day": day, "time": time, "version": self.slot_version(key),
+                    "appointments": [dict(by_id[i], id=i) for i in ids]}
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+
+    async def _commit(self):
+        """Wait until the schedule as of now is on disk; one write covers every waiting change."""
+        target = self.sched.version
+        while self._saved_version < target:
+            if self._save_task is None or self._save_task.done():
+                self._save_task = asyncio.ensure_future(self._save())
+            await asyncio.shield(self._save_task)
+
+    async def _save(self):
+        await asyncio.sleep(self.commit_delay)  # let concurrent bookings join this write
+        version = self.sched.version
+        loop = asyncio.get_running_loop()
+        if isinstance(self.store, FileStore):
+            data = self.sched.snapshot()
+            await loop.run_in_executor(None, self.store.save_snapshot, data, version)
+        else:  # SqliteStore writes row-level changes from the journal
+            changes = self.store.take_changes(self.sched)
+            if changes is not None:
+                await loop.run_in_executor(None, self.store.write_changes, changes)
+        self._saved_version = max(self._saved_version, version)
+
+    def _settled(self) -> bool:
+        """True when every change is on disk and no write is running."""
+        return self._saved_version == self.sched.version and (self._save_task is None or self._save_task.done())
+
+    async def _watch(self):
+        """Reload the event file when someone else changed it and nothing is being committed.
+
+        The file is read and parsed on a worker thread (it may wait for the file lock); the result
+        is applied on the loop, in one step, only if no booking came in meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if not self._settled():
+                continue
+            version = self.sched.version
+            try:
+                update = await loop.run_in_executor(None, self.store.fetch)
+            except Exception:
+                continue
+            if update is None or self.sched.version != version or not self._settled():
+                continue  # a booking changed the schedule meanwhile: read the file again next time
+            if self.store.apply(self.sched, update, merge=True):
+                self._saved_version = self.sched.version
+                self.seq += 1
+                self._floor = self.seq  # every slot may have changed
+
+    # -------------------------
+    # Change stream
+    # -------------------------
+
+    def _publish(self, key: tuple, op: str, a: dict) -> int:
+        self.seq += 1
+        self._slot_versions[key] = self.seq
+        change = {"seq": self.seq, "op": op, "appointment": a}
+        self._backlog.append(change)
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(change)
+            except asyncio.QueueFull:  # too slow: drop it; it resumes (or resets) on reconnect
+                self._subscribers.discard(q)
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+        return self.seq
+
+    async def _stream(self, writer, since):
+        q = asyncio.Queue(SUBSCRIBER_QUEUE)
+        self._subscribers.add(q)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n")
+            hello = {"event": self.event, "seq": self.seq}
+            oldest = self._backlog[0]["seq"] if self._backlog else self.seq + 1
+            if since is not None and (since < oldest - 1 or since > self.seq):
+                writer.write(_sse("reset", hello))
+            else:
+                writer.write(_sse("hello", hello))
+                for change in self._backlog if since is not None else ():
+                    if change["seq"] > since:
+                        writer.write(_sse("change", change, change["seq"]))
+            sent = self.seq
+            await writer.drain()
+            while True:
+                try:
+                    change = await asyncio.wait_for(q.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                else:
+                    if change is None:
+                        return
+                    if change["seq"] <= sent:
+                        continue
+                    writer.write(_sse("change", change, change["seq"]))
+                    sent = change["seq"]
+                await writer.drain()
+        finally:
+            self._subscribers.discard(q)
+
+    # -------------------------
+    # HTTP
+    # -------------------------
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, query, body = await _read_request(reader)
+                if method == "GET" and path == "/changes":
+                    since = query.get("since")
+                    await self._stream(writer, None if since is None else _int(since, "since"))
+                    return
+                status, payload = await self._route(method, path, query, body)
+            except HttpError as e:
+                status, payload = e.status, e.payload
+            writer.write(_response(status, payload))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass  # client went away or sent garbage; nothing useful to answer
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, query: dict, body) -> tuple:
+        if path == "/health" and method == "GET":
+            return 200, {"event": self.event, "version": self.sched.version,
+                         "appointments": len(self.sched.appointments), "seq": self.seq}
+        if path == "/slots" and method == "GET":
+            return 200, await self.slot(query.get("day"), query.get("time"))
+        if path == "/bookings" and method == "POST":
+            if not isinstance(body, dict):
+                raise HttpError(400, "expected a JSON object")
+            return 201, await self.book(body)
+        if path.startswith("/bookings/") and method == "DELETE":
+            aid = _int(path[len("/bookings/"):], "id")
+            return 200, await self.cancel(aid, query.get("expected_version"))
+        if path in ("/health", "/slots", "/bookings", "/changes") or path.startswith("/bookings/"):
+            raise HttpError(405, "method not allowed")
+        raise HttpError(404, "not found")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+        """Serve until cancelled; pending writes are flushed on the way out."""
+        if unix_path:
+            server = await asyncio.start_unix_server(self._handle, unix_path, backlog=4096)
+        else:
+            server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        watcher = asyncio.ensure_future(self._watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            if self._saved_version != self.sched.version:
+                await self._save()
+
+
+def _int(value, name: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{name} must be an integer")
+
+
+def _str(value, name: str) -> str:
+    if not isinstance(value, str):
+        raise HttpError(400, f"{name} must be a string")
+    return value
+
+
+async def _read_request(reader) -> tuple:
+    line = await reader.readline()
+    if not line:
+        raise asyncio.IncompleteReadError(line, None)
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = _int(headers.get("content-length", "0"), "content-length")
+    if length > MAX_BODY:
+        raise HttpError(413, "request body too large")
+    body = None
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise HttpError(400, "invalid JSON body")
+    url = urlsplit(target)
+    query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    return method.upper(), url.path, query, body
+
+
+def _response(status: int, payload: dict) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def _sse(event: str, data: dict, seq: int = None) -> bytes:
+    lines = f"event: {event}\n" + (f"id: {seq}\n" if seq is not None else "") + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return lines.encode("utf-8")
+
+
+# -------------------------
+# Client side (Streamlit sessions)
+# -------------------------
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def connect(url: str, timeout: float = None) -> http.client.HTTPConnection:
+    """HTTP connection to a service URL: "http://host:port" or "unix:/path/to.sock"."""
+    if url.startswith("unix:"):
+        return _UnixHTTPConnection(url[len("unix:"):], timeout=timeout)
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+
+
+class ChangeFeed:
+    """Background subscriber to /changes; `drain()` hands the queued changes to the next rerun.
+
+    A drained {"op": "reset"} means changes were missed and the event should be reloaded.
+    """
+
+    def __init__(self, url: str, retry: float = 2.0):
+        self.url = url
+        self.retry = retry
+        self.event = None  # event the service is booking into (from its hello)
+        self.connected = False
+        self.seq = None  # last change received; None until the first hello
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name="ubagofish-change-feed", daemon=True)
+        self._thread.start()
+
+    def pending(self) -> bool:
+        return not self._queue.empty()
+
+    def drain(self) -> list[dict]:
+        changes = []
+        while True:
+            try:
+                changes.append(self._queue.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def close(self):
+        self._stop.set()
+        sock = self._conn.sock if self._conn is not None else None
+        if sock is not None:  # unblock the reader thread
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except (OSError, http.client.HTTPException, ValueError):
+                pass
+            self.connected = False
+            self._stop.wait(self.retry)
+
+    def _listen(self):
+        self._conn = conn = connect(self.url, timeout=HEARTBEAT * 3)
+        try:
+            conn.request("GET", "/changes" if self.seq is None else f"/changes?since={self.seq}")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                return
+            self.connected = True
+            event, data = None, []
+            while not self._stop.is_set():
+                line = resp.fp.readline()
+                if not line:
+                    return
+                line = line.decode("utf-8").rstrip("\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    self._dispatch(event, json.loads("\n".join(data)))
+                    event, data = None, []
+        finally:
+            self._conn = None
+            conn.close()
+
+    def _dispatch(self, event: str, payload: dict):
+        if event == "change":
+            self.seq = payload["seq"]
+            self._queue.put(payload)
+            return
+        self.event = payload.get("event")
+        if event == "reset":
+            self._queue.put({"op": "reset", "seq": payload["seq"]})
+        if event == "reset" or self.seq is None:  # (re)start from the service's current change
+            self.seq = payload["seq"]
+
+
+def apply_changes(sched: Schedule, changes: list[dict]) -> bool:
+    """Apply streamed changes to a session's schedule; True when a reset asks for a reload.
+
+    Idempotent per appointment: a booking already present (say, reloaded from the file the
+    service wrote) is not added twice, and a cancellation removes one matching appointment.
+    """
+    reset = False
+    for change in changes:
+        if change["op"] == "reset":
+            reset = True
+            continue
+        a = change["appointment"]
+        found = sched.find_appointments(a["buyer"], a["client"], a["day"], a["time"])
+        if change["op"] == "book" and not found:
+            sched.add_appointment(a)
+        elif change["op"] == "cancel" and found:
+            sched.remove_appointment(found[0])
+    return reset
+
+
+def main(argv=None):
+    from ubagofish_events import EventRegistry
+    from ubagofish_storage import open_store
+
+    parser = argparse.ArgumentParser(description="Ubagofish booking service")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--event", help="event slug in --events-dir (default: the active event)")
+    source.add_argument("--file", help="book into this data file instead of a registry event")
+    parser.add_argument("--events-dir", default="ubagofish_events")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    args = parser.parse_args(argv)
+
+    if args.file:
+        event, store = None, open_store(args.file)
+    else:
+        registry = EventRegistry(args.events_dir)
+        event = args.event or registry.active
+        if event is None:
+            parser.error(f"no events in {args.events_dir}")
+        store = registry.open(event)
+    sched = Schedule()
+    store.load(sched)
+    service = BookingService(sched, store, event=event)
+    where = f"unix:{args.unix}" if args.unix else f"http://{args.host}:{args.port}"
+    print(f"booking into {event or args.file} ({len(sched.appointments)} appointments) on {where}")
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
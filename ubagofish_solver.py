@@ -0,0 +1,262 @@
+"""
+Ubagofish Scheduler — matching solver
+Alternative to the greedy `Schedule.randomize`: instead of filling each buyer's day in
+client order, every (day, slot) is filled with a maximum bipartite matching between the
+buyers free at that slot and the clients they still have to meet.
+
+Notes:
+- Demand is every (buyer, client) pair of the selection that is not already booked;
+  locked appointments stay fixed and count as busy slots and as met demand.
+- Pass 1 caps each buyer's day at its `balanced_bucket` share so days stay balanced;
+  pass 2 revisits every slot without the cap to place what is left.
+- Rest cadence: any `appts_before_rest + rest_slots` consecutive slots of a buyer's day
+  hold at most `appts_before_rest` meetings.
+- Matching starts from a greedy pass (each buyer's demand list is rotated so buyers start
+  on different clients), then augmenting paths (Kuhn) are searched only for the buyers left
+  unmatched. The visited set is only reset after a successful augmentation, so failed
+  searches never rescan the same clients.
+- `repair_schedule` is the incremental mode for late buyers/clients: it only books the pairs
+  of the selection that are still missing, into existing gaps, and when a pair has no common
+  gap it moves at most one unlocked meeting to another free slot of the same day. Nothing is
+  reflowed, so its cost follows the number of missing pairs, not the size of the event.
+"""
+
+import numpy as np
+
+from ubagofish_engine import HOURS, Schedule, balanced_bucket, first_slot, iter_slots
+
+
+def _cadence_ok(booked: int, p: int, appts_before_rest: int, rest_slots: int) -> bool:
+    """True if booking position `p` keeps every `appts_before_rest + rest_slots` window of `booked` within cadence."""
+    width = appts_before_rest + rest_slots
+    full = (1 << width) - 1
+    m = booked | (1 << p)
+    for s in range(max(0, p - width + 1), p + 1):
+        if ((m >> s) & full).bit_count() > appts_before_rest:
+            return False
+    return True
+
+
+def _augment(root, rem, match_c, visited, taken) -> bool:
+    """Find an augmenting path from buyer `root` avoiding clients in `taken`; flips it into `match_c` on success."""
+    stack = [(root, iter(rem[root]))]
+    via = []  # via[i] is the client through which stack[i + 1] was reached
+    while stack:
+        u, it = stack[-1]
+        for c in it:
+            if c in visited or c in taken:
+                continue
+            visited.add(c)
+            v = match_c.get(c)
+            if v is None:
+                for (w, _), cc in zip(stack, via + [c]):
+                    match_c[cc] = w
+                return True
+            via.append(c)
+            stack.append((v, iter(rem[v])))
+            break
+        else:
+            stack.pop()
+            if via:
+                via.pop()
+    return False
+
+
+def solve_matching(sched: Schedule, buyers: list[str], clients: list[str], interval: int = 30,
+                   appts_before_rest: int = 2, rest_slots: int = 1) -> int:
+    """Reflow the unlocked appointments of `buyers` with `clients`; returns the number placed."""
+    sched.remove_unlocked_appointments_for(buyers)
+    buyers = list(dict.fromkeys(buyers))
+    days = sched.selected_days[:]
+    if not buyers or not clients or not days:
+        return 0
+
+    met = set(zip(sched.appointments.names_of("buyer"), sched.appointments.names_of("client")))
+    rem = {}
+    for i, b in enumerate(buyers):
+        k = i * len(clients) // len(buyers)
+        rem[b] = {c: None for c in clients[k:] + clients[:k] if (b, c) not in met}
+
+    # per (buyer, day): slot -> position in the buyer's slot list, booked-position bitmask, day quota
+    pos_of, booked, quota = {}, {}, {}
+    by_slot = {d: {} for d in days}  # day -> slot -> buyers offering it
+    for b in buyers:
+        alloc = balanced_bucket(len(rem[b]), days)
+        for d in days:
+            slots = sched.gen_slots_for(b, d, interval)
+            pos_of[b, d] = {s: p for p, s in enumerate(slots)}
+            busy = sched.buyer_busy.get((d, b), 0)
+            booked[b, d] = sum(1 << p for p, s in enumerate(slots) if busy >> s & 1)
+            quota[b, d] = alloc[d]
+            for s in slots:
+                by_slot[d].setdefault(s, []).append(b)
+
+    def cadence_ok(b, d, p) -> bool:
+        return _cadence_ok(booked[b, d], p, appts_before_rest, rest_slots)
+
+    placed = 0
+    for capped in (True, False):
+        for d in days:
+            for slot in sorted(by_slot[d]):
+                candidates = [
+                    b for b in by_slot[d][slot]
+                    if rem[b] and (not capped or quota[b, d] > 0)
+                    and not sched.buyer_busy.get((d, b), 0) >> slot & 1
+                    and cadence_ok(b, d, pos_of[b, d][slot])
+                ]
+                if not candidates:
+                    continue
+                # most remaining demand first
+                candidates.sort(key=lambda b: -len(rem[b]))
+                cand_rem = {b: rem[b] for b in candidates}
+
+                # clients already busy at this slot (bookings only land after the matching)
+                taken = {c for c in clients if sched.client_busy.get((d, c), 0) >> slot & 1}
+
+                match_c, unmatched = {}, []
+                for b in candidates:
+                    c = next((c for c in rem[b] if c not in match_c and c not in taken), None)
+                    if c is None:
+                        unmatched.append(b)
+                    else:
+                        match_c[c] = b
+                visited = set()
+                for b in unmatched:
+                    if _augment(b, cand_rem, match_c, visited, taken):
+                        visited = set()
+                for c, b in match_c.items():
+                    sched.add_appointment({"client": c, "buyer": b, "day": d, "time": HOURS[slot], "locked": False})
+                    del rem[b][c]
+                    quota[b, d] -= 1
+                    booked[b, d] |= 1 << pos_of[b, d][slot]
+                    placed += 1
+    return placed
+
+
+def repair_schedule(sched: Schedule, buyers: list[str], clients: list[str], interval: int = 30,
+                    appts_before_rest: int = 2, rest_slots: int = 1) -> dict:
+    """Book the (buyer, client) pairs of the selection that have no meeting yet, without a reflow.
+
+    Each missing pair takes the first slot free for both sides (within the buyer's window,
+    outside lunch, keeping the rest cadence), trying first the days the client already attends
+    and then the buyer's least loaded days. When no day has a common gap, one unlocked meeting
+    of the buyer or of the client is moved to another free slot of its day to open one.
+    Returns {"placed": n, "moved": n, "unplaced": [(buyer, client), ...]}.
+    """
+    buyers, clients = list(dict.fromkeys(buyers)), list(dict.fromkeys(clients))
+    days = sched.selected_days[:]
+    result = {"placed": 0, "moved": 0, "unplaced": []}
+    if not buyers or not clients or not days:
+        return result
+
+    # met pairs from the buyer grid: days x slots per selected buyer, however large the event is;
+    # a double-booked cell keeps only one of its bookings, the others come from overbooked_cells()
+    b_codes, c_codes = sched.buyer_ids(buyers), sched.client_ids(clients)
+    occ_b = sched.grids()[0]
+    sub = occ_b[:, :, b_codes]
+    day_i, slot_i, col = np.nonzero(sub >= 0)
+    met = np.zeros((len(buyers), len(sched.id_names()[1])), bool)
+    met[col, sub[day_i, slot_i, col]] = True
+    row_of = {code: i for i, code in enumerate(b_codes)}
+    for (_, _, code), bookings in sched.overbooked_cells(0).items():
+        if code in row_of:
+            met[row_of[code], [partner for partner, _ in bookings]] = True
+    missing = np.argwhere(~met[:, c_codes])  # buyer order, then client order
+
+    windows, open_masks = {}, {}
+
+    def open_slots(b, d, without=None) -> int:
+        """Free slots of b's day that b can take within the rest cadence (as if `without` were free)."""
+        busy = sched.buyer_busy.get((d, b), 0)
+        if without is not None:
+            busy &= ~(1 << without)
+        key = (b, d, busy)
+        if key not in open_masks:
+            if (b, d) not in windows:
+                window = sched.window_mask(b, d, interval)
+                windows[b, d] = (window, {s: p for p, s in enumerate(iter_slots(window))})
+            window, pos = windows[b, d]
+            booked = sum(1 << pos[s] for s in iter_slots(busy & window))
+            open_masks[key] = sum(1 << s for s in iter_slots(window & ~busy)
+                                  if _cadence_ok(booked, pos[s], appts_before_rest, rest_slots))
+        return open_masks[key]
+
+    def free_slot(b, c, d, without=None):
+        """First slot of b's day that b (cadence included) and c can both take, or None."""
+        free = open_slots(b, d, without) & ~sched.client_busy.get((d, c), 0)
+        return first_slot(free) if free else None
+
+    def movable(side, day, s, code):
+        """Partner code of the unlocked, single booking in that grid cell (None if it cannot move)."""
+        grids = sched.grids()
+        occ, lock = grids[2 * side], grids[2 * side + 1]
+        if lock[day, s, code] or sched.is_overbooked(side, day, s, code):
+            return None
+        partner = int(occ[day, s, code])
+        return partner if partner >= 0 and not sched.is_overbooked(1 - side, day, s, partner) else None
+
+    def move(b, c, d, s, s2):
+        aid = sched.find_appointments(buyer=b, client=c, day=d, time=HOURS[s])[0]
+        sched.update_appointment(aid, {"client": c, "buyer": b, "day": d, "time": HOURS[s2], "locked": False})
+        result["moved"] += 1
+
+    def place(b, c, d, s):
+        sched.add_appointment({"client": c, "buyer": b, "day": d, "time": HOURS[s], "locked": False})
+        result["placed"] += 1
+
+    # meetings that found no other slot, per participant day: (side, name, day, busy mask, moves
+    # so far) -> slot mask; bookings only fill slots, so a failure holds until a move frees one
+    stuck = {}
+
+    def repair(b, c, d) -> bool:
+        """Open a slot for (b, c) on day d by moving one unlocked meeting of b or c within the day."""
+        open_b = open_slots(b, d)
+        if not open_b:  # either move ends with b booked on one more slot
+            return False
+        busy_b, busy_c = sched.buyer_busy.get((d, b), 0), sched.client_busy.get((d, c), 0)
+        buyer_names, client_names = sched.id_names()
+        b_code, c_code = sched.buyer_ids([b])[0], sched.client_ids([c])[0]
+        day = sched.appointments.names[2].index(d)
+        # the client is busy at a slot the buyer could take: move the client's meeting in its buyer's day
+        key = (1, c, d, busy_c, result["moved"])
+        failed = stuck.get(key, 0)
+        for s in iter_slots(open_b & busy_c & ~failed):
+            partner = movable(1, day, s, c_code)
+            b2 = buyer_names[partner] if partner is not None else None
+            s2 = free_slot(b2, c, d, without=s) if b2 is not None else None
+            if s2 is None:
+                failed |= 1 << s
+                continue
+            move(b2, c, d, s, s2)
+            place(b, c, d, s)
+            return True
+        stuck[key] = failed
+        # the buyer is busy at a slot the client has free: move the buyer's meeting to another gap
+        key = (0, b, d, busy_b, result["moved"])
+        failed = stuck.get(key, 0)
+        for s in iter_slots(windows[b, d][0] & busy_b & ~busy_c & ~failed):
+            partner = movable(0, day, s, b_code)
+            c2 = client_names[partner] if partner is not None else None
+            s2 = free_slot(b, c2, d) if c2 is not None else None
+            if s2 is None:
+                failed |= 1 << s
+                continue
+            move(b, c2, d, s, s2)
+            place(b, c, d, s)
+            return True
+        stuck[key] = failed
+        return False
+
+    for bi, ci in missing.tolist():
+        b, c = buyers[bi], clients[ci]
+        order = sorted(days, key=lambda d: (not sched.client_busy.get((d, c), 0),
+                                            sched.buyer_busy.get((d, b), 0).bit_count()))
+        for d in order:
+            s = free_slot(b, c, d)
+            if s is not None:
+                place(b, c, d, s)
+                break
+        else:
+            if not any(repair(b, c, d) for d in order):
+                result["unplaced"].append((b, c))
+    return result
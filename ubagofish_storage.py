@@ -0,0 +1,742 @@
+"""
+Ubagofish Scheduler — persistence
+Load/save of a `Schedule` to the on-disk data file, kept out of the UI so the app, batch
+jobs and benchmarks share one implementation. Three backends share the load/save/autosave/flush
+interface: `JsonStore` (one JSON document), `SnapshotStore` (versioned binary snapshot) and
+`SqliteStore` (indexed tables, WAL mode); `open_store()` picks one from the file extension.
+
+Notes:
+- `autosave()` is cheap when nothing changed: it compares `Schedule.version` with the version
+  last written and returns immediately.
+- Changes are written after `delay` seconds of quiet on a timer thread, so a burst of edits
+  (several reruns in a row) ends up as a single write of the latest snapshot.
+- Writes whose serialized bytes hash to the same digest as the last write/load are skipped.
+- While a write is pending, `load()` keeps the in-memory schedule, which is newer than the file.
+- File stores (`JsonStore`, `SnapshotStore`) first compare the file's (mtime, size, inode)
+  with what they last read or wrote, so an unchanged file costs one stat() per rerun; a
+  changed stat with identical bytes (same digest) is not re-parsed either.
+- File writes go to a temp file in the same directory, are fsync'ed and renamed over the data
+  file, so readers see either the old or the new document, never a torn one. Writers take an
+  exclusive advisory lock on `<path>.lock`, readers a shared one; both give up after
+  `lock_timeout` seconds instead of blocking the UI.
+- Writes are compare-and-swap: if another process rewrote the file since this store last read
+  or wrote it, the write is merged into that document (three-way, against the document this
+  store last saw) instead of overwriting it, and the next `load()` brings the other side's
+  changes in. `load(sched, merge=True)` applies a file on top of `sched` the same way, so
+  appointments present on both sides keep their IDs.
+- Snapshots store each appointment column as one little-endian blob (optionally compressed with
+  zlib/bz2/lzma) coded against the name tables in the header, so loading is a few array copies
+  and a vectorized occupancy rebuild instead of parsing one dict per appointment.
+- SqliteStore replays `Schedule.journal` so single edits become single-row inserts/deletes
+  (O(log n) through the (day, time, buyer) / (day, time, client) indexes), and uses
+  `PRAGMA data_version` to skip reloading when no other connection committed.
+"""
+
+import bz2
+from contextlib import contextmanager
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import sqlite3
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from ubagofish_engine import SETTINGS, AppointmentTable, Schedule
+from ubagofish_schema import SCHEMA_VERSION, NewerSchemaError, schema_version
+
+
+def _digest(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def _plain(obj):
+    if isinstance(obj, AppointmentTable):  # snapshots keep the compact table
+        return obj.to_list()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _encode(data: dict) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False, default=_plain).encode("utf-8")
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, timeout: float = 5.0):
+    """Advisory inter-process lock on `<path>.lock`; raises TimeoutError after `timeout` seconds.
+
+    Shared locks need fcntl; on Windows every lock is exclusive.
+    """
+    with open(path + ".lock", "a+b") as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"could not lock {path}")
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _settings(sched: Schedule) -> dict:
+    """Names and settings of `sched` as an `update_from_dict()` payload (no appointments)."""
+    return dict({key: getattr(sched, key) for key in ("clients", "buyers") + SETTINGS}, schema_version=SCHEMA_VERSION)
+
+
+def _sync(sched: Schedule, fresh: Schedule):
+    """Give `sched` the names, settings and appointments of `fresh`; shared appointments keep their IDs."""
+    sched.update_from_dict(_settings(fresh))
+    sched.sync_appointments(fresh.appointments)
+
+
+def _file_mode(path: str) -> int:
+    """Permission bits for `path`: the existing file's, else the umask default of a new file."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def atomic_write(path: str, payload: bytes):
+    """Write `payload` to a temp file, fsync it and rename it over `path` (keeping its permissions)."""
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=dirname)
+    try:
+        if hasattr(os, "fchmod"):  # mkstemp creates 0600 files, which the rename would keep
+            os.fchmod(fd, _file_mode(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # make the rename itself durable
+        dfd = os.open(dirname, os.O_DIRECTORY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+
+
+class FileStore:
+    """Whole-file store: atomic writes, advisory locks, debounced autosave, stat/digest caching.
+
+    Subclasses define the file format through `_serialize()`, `_parse()` and `_apply()`.
+    """
+
+    def __init__(self, path: str, delay: float = 0.5, lock_timeout: float = 5.0):
+        self.path = path
+        self.delay = delay
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._saved_version = None  # Schedule.version matching the file
+        self._digest = None  # digest of the bytes last written or read
+        self._stat = None  # (mtime_ns, size, inode) of the file as last written or read
+        self._base = None  # snapshot of the document as last written or read (merge base)
+        self._pending = None  # snapshot waiting for the timer
+        self._timer = None
+
+    def load(self, sched: Schedule, merge: bool = False) -> bool:
+        """Apply the file to `sched`; returns False if there is nothing (newer) to load.
+
+        With `merge`, only the appointments that differ are added or removed (see
+        `Schedule.sync_appointments`), instead of replacing them all. Raises TimeoutError when
+        the file stays locked: the caller must not save a schedule it could not load.
+        """
+        update = self.fetch()
+        return update is not None and self.apply(sched, update, merge)
+
+    def fetch(self):
+        """The file's parsed document if it changed since our last load/save, else None.
+
+        Reads and parses only, without touching any schedule, so it can run on a worker thread;
+        hand the result to `apply()` on the thread that owns the schedule.
+        """
+        with self._lock:
+            if self._pending is not None or self._file_stat() in (None, self._stat):
+                return None
+            try:
+                with file_lock(self.path, shared=True, timeout=self.lock_timeout):
+                    with open(self.path, "rb") as f:
+                        raw = f.read()
+                        stat = self._file_stat(f.fileno())
+                digest = _digest(raw)
+                if digest == self._digest:  # touched or rewritten with the same content
+                    self._stat = stat
+                    return None
+                parsed = self._parse(raw)
+            except (NewerSchemaError, TimeoutError):
+                raise
+            except Exception:
+                return None
+            return self._stat, stat, digest, parsed
+
+    def apply(self, sched: Schedule, update, merge: bool = False) -> bool:
+        """Apply a `fetch()` result to `sched` (see `load()`).
+
+        Returns False without touching `sched` when the file was read or written in between, or a
+        write is pending; fetch again.
+        """
+        seen, stat, digest, parsed = update
+        with self._lock:
+            if self._stat != seen or self._pending is not None:
+                return False
+            if merge:
+                _sync(sched, self._document(parsed, like=sched))
+            else:
+                self._apply(parsed, sched)
+            self._saved_version = sched.version
+            self._digest = digest
+            self._stat = stat
+            self._base = sched.snapshot()
+        return True
+
+    def save(self, sched: Schedule):
+        """Write now, cancelling any pending deferred write."""
+        self.save_snapshot(sched.snapshot(), sched.version)
+
+    def save_snapshot(self, data: dict, version: int):
+        """Write `data` (a `Schedule.snapshot()` taken at `version`) now.
+
+        Needs no access to the schedule, so it can run on a worker thread while the owner
+        keeps changing it.
+        """
+        with self._lock:
+            self._cancel()
+            self._write(data)
+            self._saved_version = version
+
+    def autosave(self, sched: Schedule):
+        """Schedule a write of `sched` if it changed since the last save."""
+        with self._lock:
+            if sched.version == self._saved_version:
+                return
+            self._pending = sched.snapshot()
+            self._saved_version = sched.version
+            self._cancel()
+            if self.delay <= 0:
+                self._flush_locked()
+                return
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = False  # let the last write finish on shutdown
+            self._timer.start()
+
+    def flush(self):
+        """Write the pending snapshot, if any."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+
+    def _flush_locked(self):
+        data, self._pending = self._pending, None
+        if data is not None:
+            try:
+                self._write(data)
+            except OSError:  # includes TimeoutError from the file lock
+                self._saved_version = None  # retried by the next autosave()
+
+    def _cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _serialize(self, data: dict) -> bytes:
+        raise NotImplementedError
+
+    def _parse(self, raw: bytes):
+        raise NotImplementedError
+
+    def _apply(self, parsed, sched: Schedule):
+        raise NotImplementedError
+
+    def _document(self, parsed, like: Schedule = None) -> Schedule:
+        """The parsed file as a new schedule (keys the file lacks default to `like`'s settings)."""
+        fresh = Schedule()
+        if like is not None:
+            fresh.update_from_dict(_settings(like))
+        self._apply(parsed, fresh)
+        return fresh
+
+    def _merge(self, data: dict, parsed) -> dict:
+        """Three-way merge of the snapshot `data` into the file's document, against `self._base`.
+
+        Names and settings: ours where we changed them, the file's otherwise (always the file's
+        when this store never read or wrote it, as after a failed load). Appointments: the
+        file's, minus the ones we removed, plus the ones we added.
+        """
+        base = self._base or {}
+        merged = self._document(parsed)
+        for key in ("clients", "buyers") + SETTINGS:
+            if key in base and data[key] != base[key]:
+                setattr(merged, key, data[key])
+        merged.merge_appointments(base.get("appointments") or AppointmentTable(([], [], [])), data["appointments"])
+        return merged.snapshot()
+
+    def _write(self, data: dict):
+        payload = self._serialize(data)
+        digest = _digest(payload)
+        if digest == self._digest:
+            return
+        ours, merged = data, False
+        with file_lock(self.path, timeout=self.lock_timeout):
+            if self._file_stat() not in (None, self._stat):
+                # someone else wrote the file since we last read or wrote it: merge, don't overwrite
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                try:
+                    parsed = self._parse(raw) if _digest(raw) != self._digest else None
+                except NewerSchemaError:
+                    raise
+                except Exception:  # unreadable: nothing to keep
+                    parsed = None
+                if parsed is not None:
+                    data = self._merge(data, parsed)
+                    payload = self._serialize(data)
+                    digest = _digest(payload)
+                    merged = True
+            atomic_write(self.path, payload)
+            # after a merge the caller's schedule lacks the other side's changes: let load() apply them
+            self._stat = None if merged else self._file_stat()
+        self._digest = None if merged else digest
+        # the merge base is what the caller holds: changes it has not loaded yet are not its deletions
+        self._base = ours
+
+    def _file_stat(self, fd: int = None):
+        """(mtime_ns, size, inode) of the data file, or None when it does not exist."""
+        try:
+            st = os.fstat(fd) if fd is not None else os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class JsonStore(FileStore):
+    """Single JSON document per event (the historical `ubagofish_data.json` format).
+
+    A file in an older schema is migrated on load and, with `upgrade_in_place`, rewritten once
+    in the current schema after copying the original to `<path>.v<version>.bak`.
+    """
+
+    def __init__(self, path: str, delay: float = 0.5, lock_timeout: float = 5.0, upgrade_in_place: bool = True):
+        super().__init__(path, delay=delay, lock_timeout=lock_timeout)
+        self.upgrade_in_place = upgrade_in_place
+        self._loaded_schema = SCHEMA_VERSION
+
+    def load(self, sched: Schedule, merge: bool = False) -> bool:
+        if not super().load(sched, merge):
+            return False
+        if self._loaded_schema < SCHEMA_VERSION and self.upgrade_in_place:
+            self._upgrade_file(sched)
+        return True
+
+    def _upgrade_file(self, sched: Schedule):
+        backup = f"{self.path}.v{self._loaded_schema}.bak"
+        try:
+            if not os.path.exists(backup):
+                with file_lock(self.path, shared=True, timeout=self.lock_timeout):
+                    shutil.copy2(self.path, backup)
+            self.save(sched)
+        except OSError:  # keep the old file; it is migrated again on the next load
+            return
+        self._loaded_schema = SCHEMA_VERSION
+
+    def _serialize(self, data: dict) -> bytes:
+        return _encode(data)
+
+    def _parse(self, raw: bytes):
+        data = json.loads(raw)
+        self._loaded_schema = schema_version(data)
+        return data
+
+    def _apply(self, parsed, sched: Schedule):
+        sched.update_from_dict(parsed)
+
+
+SNAPSHOT_MAGIC = b"UBGS"
+SNAPSHOT_FORMAT = 1
+_SNAPSHOT_HEAD = struct.Struct("<4sHHI")  # magic, format version, reserved, header length
+_SNAPSHOT_COLUMNS = (("buyer", "<i4"), ("client", "<i4"), ("day", "i1"), ("slot", "i1"), ("locked", "i1"))
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "bz2": (bz2.compress, bz2.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def encode_snapshot(data: dict, compression: str = None) -> bytes:
+    """Binary snapshot of `data` (as returned by `Schedule.snapshot()`).
+
+    Layout: fixed head (magic, format, header length), a JSON header (settings, buyers,
+    clients, name tables, column directory), then one blob per appointment column. Blobs
+    start on 8-byte boundaries, so uncompressed snapshots can be memory-mapped and viewed
+    with `np.frombuffer` without copying.
+    """
+    table = data["appointments"]
+    compress = CODECS[compression][0] if compression else None
+    blobs, columns, offset = [], [], 0
+    for name, dtype in _SNAPSHOT_COLUMNS:
+        blob = np.asarray(getattr(table, name)).astype(dtype).tobytes()
+        if compress is not None:
+            blob = compress(blob)
+        columns.append([name, dtype, offset, len(blob)])
+        blobs.append(blob + bytes(-len(blob) % 8))
+        offset += len(blobs[-1])
+    header = {
+        "settings": {k: data[k] for k in SETTINGS},
+        "buyers": data["buyers"],
+        "clients": data["clients"],
+        "names": [list(names) for names in table.names],
+        "count": len(table),
+        "codec": compression,
+        "columns": columns,
+    }
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    head += b" " * (-(_SNAPSHOT_HEAD.size + len(head)) % 8)
+    return b"".join([_SNAPSHOT_HEAD.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, 0, len(head)), head, *blobs])
+
+
+def decode_snapshot(raw) -> tuple:
+    """(data, names, columns) from a snapshot in `raw` (bytes, memoryview or mmap).
+
+    `data` is a `Schedule.update_from_dict()` payload without appointments; `columns` maps
+    each column name to a NumPy array (a view into `raw` when uncompressed), coded against
+    the (buyer, client, day) name lists in `names`. Raises ValueError on anything malformed.
+    """
+    buf = memoryview(raw)
+    if len(buf) < _SNAPSHOT_HEAD.size:
+        raise ValueError("truncated snapshot")
+    magic, version, _, head_len = _SNAPSHOT_HEAD.unpack_from(buf)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a ubagofish snapshot")
+    if version > SNAPSHOT_FORMAT:
+        raise NewerSchemaError(f"snapshot format {version} is newer than this version supports ({SNAPSHOT_FORMAT})")
+    base = _SNAPSHOT_HEAD.size + head_len
+    header = json.loads(bytes(buf[_SNAPSHOT_HEAD.size:base]))
+    decompress = CODECS[header["codec"]][1] if header["codec"] else None
+    columns = {}
+    for name, dtype, offset, length in header["columns"]:
+        if base + offset + length > len(buf):
+            raise ValueError("truncated snapshot")
+        blob = buf[base + offset:base + offset + length]
+        if decompress is not None:
+            blob = decompress(blob)
+        columns[name] = np.frombuffer(blob, dtype)
+        if len(columns[name]) != header["count"]:
+            raise ValueError(f"column {name!r} has {len(columns[name])} rows, expected {header['count']}")
+    data = dict(header["settings"], buyers=header["buyers"], clients=header["clients"], schema_version=SCHEMA_VERSION)
+    return data, header["names"], columns
+
+
+class SnapshotStore(FileStore):
+    """Binary snapshot per event (`.ubs`): columnar appointments plus a name table.
+
+    When the snapshot does not exist yet but `legacy_path` (default: the same name with a
+    .json extension) does, the JSON file is loaded and a snapshot written from it.
+    """
+
+    def __init__(self, path: str, delay: float = 0.5, lock_timeout: float = 5.0,
+                 compression: str = None, legacy_path: str = None):
+        super().__init__(path, delay=delay, lock_timeout=lock_timeout)
+        if compression is not None and compression not in CODECS:
+            raise ValueError(f"unknown compression {compression!r} (expected one of {sorted(CODECS)})")
+        self.compression = compression
+        self._legacy = JsonStore(legacy_path or os.path.splitext(path)[0] + ".json", lock_timeout=lock_timeout,
+                                 upgrade_in_place=False)
+
+    def load(self, sched: Schedule, merge: bool = False) -> bool:
+        if self._file_stat() is None and os.path.exists(self._legacy.path):
+            if not self._legacy.load(sched, merge):
+                return False
+            try:
+                self.save(sched)
+            except OSError:  # keep the legacy data in memory; the next autosave retries
+                self._saved_version = None
+            return True
+        return super().load(sched, merge)
+
+    def _serialize(self, data: dict) -> bytes:
+        return encode_snapshot(data, self.compression)
+
+    def _parse(self, raw: bytes):
+        return decode_snapshot(raw)
+
+    def _apply(self, parsed, sched: Schedule):
+        data, names, columns = parsed
+        sched.update_from_dict(data)
+        sched.set_appointment_columns(names, columns)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buyers (pos INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS clients (pos INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY,
+    client TEXT, buyer TEXT, day TEXT, time TEXT,
+    locked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS appointments_buyer_slot ON appointments (day, time, buyer);
+CREATE INDEX IF NOT EXISTS appointments_client_slot ON appointments (day, time, client);
+CREATE TABLE IF NOT EXISTS time_windows (
+    buyer TEXT NOT NULL, day TEXT NOT NULL, start TEXT, "end" TEXT,
+    PRIMARY KEY (buyer, day)
+);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);  -- JSON-encoded values
+"""
+
+_PLAIN_SETTINGS = tuple(k for k in SETTINGS if k != "time_windows")
+
+
+class SqliteStore:
+    """One SQLite database per event; edits are written as row-level changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._saved_version = None
+        self._data_version = None  # PRAGMA data_version at our last load/save
+        self._saved = {}  # names/settings as last written, to skip unchanged tables
+
+    def close(self):
+        self._conn.close()
+
+    def load(self, sched: Schedule, merge: bool = False) -> bool:
+        """Apply the database to `sched`; returns False if nobody changed it since our last load/save.
+
+        With `merge`, only the appointments that differ are added or removed (see `FileStore.load`).
+        """
+        update = self.fetch()
+        return update is not None and self.apply(sched, update, merge)
+
+    def fetch(self):
+        """The database as an `update_from_dict()` payload if another connection changed it, else None.
+
+        Reads only, so it can run on a worker thread; hand the result to `apply()`.
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            data_version = cur.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return None
+            settings = dict(cur.execute("SELECT key, value FROM settings"))
+            if not settings:
+                return None
+            data = {key: json.loads(value) for key, value in settings.items() if key in _PLAIN_SETTINGS}
+            data["schema_version"] = SCHEMA_VERSION  # rows are always written in the current schema
+            data["buyers"] = [n for (n,) in cur.execute("SELECT name FROM buyers ORDER BY pos")]
+            data["clients"] = [n for (n,) in cur.execute("SELECT name FROM clients ORDER BY pos")]
+            windows = {}
+            for buyer, day, start, end in cur.execute('SELECT buyer, day, start, "end" FROM time_windows'):
+                windows.setdefault(buyer, {})[day] = {"start": start, "end": end}
+            data["time_windows"] = windows
+            data["appointments"] = [
+                {"client": c, "buyer": b, "day": d, "time": t, "locked": bool(lk)}
+                for c, b, d, t, lk in cur.execute("SELECT client, buyer, day, time, locked FROM appointments ORDER BY id")
+            ]
+            return self._data_version, data_version, data
+
+    def apply(self, sched: Schedule, update, merge: bool = False) -> bool:
+        """Apply a `fetch()` result to `sched`; False (nothing applied) if another load came in between."""
+        seen, data_version, data = update
+        with self._lock:
+            if self._data_version != seen:
+                return False
+            if merge:
+                data = dict(data)
+                fresh = Schedule()
+                fresh.set_appointments(data.pop("appointments"))
+                sched.update_from_dict(data)
+                sched.sync_appointments(fresh.appointments)
+            else:
+                sched.update_from_dict(data)
+            sched.journal = []  # what was just read is already in the database
+            self._remember(sched)
+            self._saved_version = sched.version
+            self._data_version = data_version
+        return True
+
+    def save(self, sched: Schedule):
+        """Rewrite every table from `sched`."""
+        with self._lock:
+            self._write(self._changes(sched, full=True))
+
+    def autosave(self, sched: Schedule):
+        """Write what changed since the last save (row-level for appointments)."""
+        with self._lock:
+            if sched.version == self._saved_version:
+                return
+            self._write(self._changes(sched, full=sched.journal is None or self._saved_version is None))
+
+    def take_changes(self, sched: Schedule):
+        """What `autosave()` would write, captured from `sched` now, or None when nothing changed.
+
+        The journal is taken and everything else copied, so `write_changes()` can run on a worker
+        thread while the owner keeps changing the schedule.
+        """
+        with self._lock:
+            if sched.version == self._saved_version:
+                return None
+            return self._changes(sched, full=sched.journal is None or self._saved_version is None)
+
+    def write_changes(self, changes: dict):
+        """Write a `take_changes()` result."""
+        with self._lock:
+            self._write(changes)
+
+    def flush(self):
+        """Writes are synchronous; kept for interface parity with the file stores."""
+
+    def _remember(self, sched: Schedule):
+        self._saved = {
+            "buyers": list(sched.buyers),
+            "clients": list(sched.clients),
+            "settings": {k: getattr(sched, k) for k in _PLAIN_SETTINGS},
+            "time_windows": json.loads(json.dumps(sched.time_windows)),
+        }
+
+    @staticmethod
+    def _changes(sched: Schedule, full: bool) -> dict:
+        """Everything `_write()` needs from `sched`, copied; takes the journal."""
+        journal, sched.journal = sched.journal, []
+        full = full or any(delta == 0 for delta, _ in journal)  # (0, None): everything was replaced
+        return {
+            "version": sched.version,
+            "journal": journal,
+            "buyers": list(sched.buyers),
+            "clients": list(sched.clients),
+            "settings": json.loads(json.dumps({k: getattr(sched, k) for k in _PLAIN_SETTINGS})),
+            "time_windows": json.loads(json.dumps(sched.time_windows)),
+            "appointments": sched.appointments.copy() if full else None,  # None: write the journal
+        }
+
+    def _write(self, changes: dict):
+        cur = self._conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            saved = self._saved if changes["appointments"] is None else {}
+            for table in ("buyers", "clients"):
+                names = changes[table]
+                if saved.get(table) != names:
+                    cur.execute(f"DELETE FROM {table}")
+                    cur.executemany(f"INSERT INTO {table} (pos, name) VALUES (?, ?)", enumerate(names))
+            settings = changes["settings"]
+            old = saved.get("settings", {})
+            cur.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [(k, json.dumps(v, ensure_ascii=False)) for k, v in settings.items() if k not in old or old[k] != v],
+            )
+            self._write_windows(cur, changes["time_windows"], saved.get("time_windows"))
+            if changes["appointments"] is not None:
+                self._write_all_appointments(cur, changes["appointments"])
+            else:
+                for delta, a in changes["journal"]:
+                    row = (a["client"], a["buyer"], a["day"], a["time"], int(bool(a.get("locked"))))
+                    if delta > 0:
+                        cur.execute("INSERT INTO appointments (client, buyer, day, time, locked) VALUES (?, ?, ?, ?, ?)", row)
+                    else:
+                        cur.execute(
+                            "DELETE FROM appointments WHERE id = (SELECT id FROM appointments"
+                            " WHERE client = ? AND buyer = ? AND day = ? AND time = ? AND locked = ? LIMIT 1)",
+                            row,
+                        )
+            cur.execute("COMMIT")
+        except BaseException:
+            if self._conn.in_transaction:
+                cur.execute("ROLLBACK")
+            self._saved_version = None  # unknown state on disk: the next autosave rewrites everything
+            raise
+        self._saved = {key: changes[key] for key in ("buyers", "clients", "settings", "time_windows")}
+        self._saved_version = changes["version"]
+
+    def _write_windows(self, cur, windows: dict, old):
+        if old is None:
+            cur.execute("DELETE FROM time_windows")
+            old = {}
+        rows = [
+            (buyer, day, w.get("start"), w.get("end"))
+            for buyer, days in windows.items() for day, w in days.items()
+            if old.get(buyer, {}).get(day) != w
+        ]
+        cur.executemany(
+            'INSERT INTO time_windows (buyer, day, start, "end") VALUES (?, ?, ?, ?)'
+            ' ON CONFLICT(buyer, day) DO UPDATE SET start = excluded.start, "end" = excluded."end"',
+            rows,
+        )
+        gone = [(buyer, day) for buyer, days in old.items() for day in days if day not in windows.get(buyer, {})]
+        cur.executemany("DELETE FROM time_windows WHERE buyer = ? AND day = ?", gone)
+
+    @staticmethod
+    def _write_all_appointments(cur, appointments: list[dict]):
+        cur.execute("DELETE FROM appointments")
+        cur.executemany(
+            "INSERT INTO appointments (client, buyer, day, time, locked) VALUES (?, ?, ?, ?, ?)",
+            [(a["client"], a["buyer"], a["day"], a["time"], int(bool(a.get("locked")))) for a in appointments],
+        )
+
+
+def open_store(path: str):
+    """SqliteStore for .sqlite/.sqlite3/.db paths, SnapshotStore for .ubs, JsonStore otherwise."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".sqlite", ".sqlite3", ".db"):
+        return SqliteStore(path)
+    if ext == ".ubs":
+        return SnapshotStore(path)
+    return JsonStore(path)
+
+
+def import_json(json_path: str, db_path: str) -> int:
+    """One-shot import of a JSON data file (any historical format) into a SQLite or snapshot store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        sched = Schedule.from_dict(json.load(f))
+    store = open_store(db_path)
+    try:
+        store.save(sched)
+    finally:
+        store.close()
+    return len(sched.appointments)
+
+
+if __name__ == "__main__":
+    # python ubagofish_storage.py ubagofish_data.json ubagofish_data.sqlite
+    if len(sys.argv) != 3:
+        sys.exit("usage: python ubagofish_storage.py SOURCE.json TARGET.sqlite|TARGET.ubs")
+    print(f"{import_json(sys.argv[1], sys.argv[2])} appointments imported into {sys.argv[2]}")
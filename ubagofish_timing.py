@@ -0,0 +1,80 @@
+"""
+Ubagofish Scheduler — rerun phase timing
+Opt-in spans around the phases of a Streamlit rerun (load, sidebar, time-window widgets,
+randomizer, calendar, export, editor, autosave).
+
+Notes:
+- While disabled, `span()` hands back one shared no-op context manager: no clock reads,
+  no allocations.
+- `finish()` appends one JSON line per rerun to the log ({"ts", "total", "phases": {name: s}})
+  and feeds a rolling window per phase for the p50/p95 shown in the debug panel.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+WINDOW = 200  # reruns kept per phase for the rolling percentiles
+_OFF = nullcontext()
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of `values` (0 <= q <= 1)."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class PhaseTimer:
+    """Per-rerun spans plus rolling per-phase history; keep one instance per session."""
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.enabled = False
+        self.spans = {}
+        self.history = {}  # phase -> deque of the last `window` durations (seconds)
+        self._start = 0.0
+
+    def start(self, enabled: bool):
+        """Begin a rerun; spans are only recorded when `enabled`."""
+        self.enabled = enabled
+        self.spans = {}
+        if enabled:
+            self._start = time.perf_counter()
+
+    def span(self, phase: str):
+        """Context manager timing one phase (durations of repeated phases add up)."""
+        return self._span(phase) if self.enabled else _OFF
+
+    @contextmanager
+    def _span(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[phase] = self.spans.get(phase, 0.0) + time.perf_counter() - start
+
+    def finish(self, log_path: str = None):
+        """Close the rerun: update the rolling history and append a JSON line to `log_path`."""
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self._start
+        for phase, seconds in list(self.spans.items()) + [("total", total)]:
+            self.history.setdefault(phase, deque(maxlen=self.window)).append(seconds)
+        if log_path:
+            record = {"ts": time.time(), "total": round(total, 6),
+                      "phases": {phase: round(seconds, 6) for phase, seconds in self.spans.items()}}
+            try:
+                with open(log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError:
+                pass
+
+    def stats(self) -> list[dict]:
+        """One row per phase: last rerun, rolling p50/p95 (milliseconds) and sample count."""
+        return [
+            {"phase": phase, "last_ms": round(self.spans.get(phase, values[-1]) * 1000, 1),
+             "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+             "p95_ms": round(percentile(values, 0.95) * 1000, 1), "n": len(values)}
+            for phase, values in self.history.items()
+        ]